@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+"""
+Benchmarks for bin/pattern_manager.py on synthetic filename sets.
+
+Each case creates a directory of empty files that follow one of the layouts below, and measures the wall time
+and the peak memory of the four phases of create_hyperstack: the FilelistGrouper constructor, group_files,
+find_patterns and write. Every case runs in a fresh child process, so the phases do not inherit memory
+from earlier cases.
+
+Layouts:
+    plate:  r02c03f01p04-ch2t05.tiff            (row/column/field/plane/channel/timepoint grid)
+    scanr:  A1--W00001--P00001--Z00000--T00000--488nm.tif
+    oir:    23052022_T26IG4_0000.oir
+
+The results are written to benchmarks/results/<git revision>.json, and --compare prints the relative change
+against the results of an earlier revision.
+
+    python benchmarks/bench_pattern_manager.py --sizes 1000,10000,100000
+    python benchmarks/bench_pattern_manager.py --sizes 5000000 --layouts scanr --memory
+    python benchmarks/bench_pattern_manager.py --compare <revision>
+"""
+import os, sys, json, time
+import argparse
+import contextlib, io
+import itertools, random
+import multiprocessing
+import platform
+import queue as queues
+import resource
+import shutil
+import subprocess
+import tempfile
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BINPATH = os.path.join(os.path.dirname(HERE), 'bin')
+RESULTS = os.path.join(HERE, 'results')
+PHASES = ('FilelistGrouper', 'group_files', 'find_patterns', 'write')
+
+def plate_names(seed):
+    rnd = random.Random(seed)
+    for row, col in itertools.product(range(1, 17), range(1, 25)):
+        for field, plane, t, ch in itertools.product(range(1, 10), range(1, 11), range(1, 101), range(1, 5)):
+            if rnd.random() < 0.02: ### a few missing images
+                continue
+            yield 'r%02dc%02df%02dp%02d-ch%dt%02d.tiff' % (row, col, field, plane, ch, t)
+
+def scanr_names(seed):
+    rnd = random.Random(seed)
+    well = 0
+    for row in 'ABCDEFGHIJKLMNOP':
+        for col in range(1, 25):
+            well += 1
+            for pos, z, t, ch in itertools.product(range(1, 10), range(0, 20), range(0, 100), ('488nm', '561nm', 'Transmission-CSU')):
+                if rnd.random() < 0.02:
+                    continue
+                yield '%s%s--W%05d--P%05d--Z%05d--T%05d--%s.tif' % (row, col, well, pos, z, t, ch)
+
+def oir_names(seed):
+    rnd = random.Random(seed)
+    for day in range(1, 29):
+        for a, b in itertools.product('ABCDEFGHIJKLMNOPQRSTUVWXYZ', range(1, 10)):
+            ### irregular numbering and occasional five-digit indices, as produced by the acquisition software
+            count = rnd.randint(1, 2000)
+            for i in range(count):
+                width = 5 if i >= 1000 else 4
+                yield '%02d052022_T26%sG%s_%s.oir' % (day, a, b, str(i).zfill(width))
+
+LAYOUTS = {'plate': plate_names, 'scanr': scanr_names, 'oir': oir_names}
+
+def create_files(layout, size, workdir, seed):
+    rootDir = tempfile.mkdtemp(prefix = 'bench_%s_%s_' % (layout, size), dir = workdir)
+    count = 0
+    for name in itertools.islice(LAYOUTS[layout](seed), size):
+        open(os.path.join(rootDir, name), 'w').close()
+        count += 1
+    if count < size:
+        print("The %s layout has only %s names." % (layout, count))
+    return rootDir, count
+
+def run_phases(rootDir, memory):
+    """ Runs the four phases on rootDir. Returns the wall time and, if memory is True, the traced peak memory of each phase. """
+    sys.path.insert(0, BINPATH)
+    from pattern_manager import FilelistGrouper
+    results = {}
+    grouper = None
+    def phase(name, func):
+        if memory:
+            tracemalloc.reset_peak()
+        t0 = time.perf_counter()
+        out = func()
+        results[name] = {'wall': time.perf_counter() - t0}
+        if memory:
+            results[name]['peak_mem'] = tracemalloc.get_traced_memory()[1]
+        results[name]['maxrss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        return out
+    if memory:
+        tracemalloc.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        grouper = phase('FilelistGrouper', lambda: FilelistGrouper(rootDir))
+        grps = phase('group_files', grouper.group_files)
+        phase('find_patterns', grouper.find_patterns)
+        phase('write', grouper.write)
+    if memory:
+        tracemalloc.stop()
+    results['ngroups'] = len(grps)
+    return results
+
+def run_case(layout, size, workdir, seed, memory, queue):
+    rootDir, count = create_files(layout, size, workdir, seed)
+    try:
+        result = {'layout': layout, 'size': count}
+        result.update(run_phases(rootDir, False))
+        if memory:
+            ### tracemalloc slows the phases down, so memory is measured in a separate pass.
+            for path in os.listdir(rootDir):
+                if path.endswith('.pattern'):
+                    os.remove(os.path.join(rootDir, path))
+            shutil.rmtree(os.path.join(rootDir, 'tempdir'), ignore_errors = True)
+            traced = run_phases(rootDir, True)
+            for name in PHASES:
+                result[name]['peak_mem'] = traced[name]['peak_mem']
+        queue.put(result)
+    finally:
+        shutil.rmtree(rootDir, ignore_errors = True)
+
+def git_revision():
+    try:
+        rev = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd = HERE, capture_output = True, text = True, check = True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--', BINPATH], cwd = HERE, capture_output = True, text = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return rev + '-dirty' if dirty else rev
+
+def report(results, reference = None, header = True):
+    ref = {}
+    if reference is not None:
+        ref = {(r['layout'], r['size']): r for r in reference['cases']}
+    if header:
+        print('%-8s %9s %-16s %10s %12s %s' % ('layout', 'size', 'phase', 'wall [s]', 'peak [MB]', '' if reference is None else 'vs ' + reference['revision']))
+    for case in results:
+        for name in PHASES:
+            item = case[name]
+            peak = '%.1f' % (item['peak_mem'] / 1e6) if 'peak_mem' in item else '-'
+            change = ''
+            old = ref.get((case['layout'], case['size']))
+            if old is not None and old[name]['wall'] > 0:
+                change = '%+.1f%%' % (100 * (item['wall'] / old[name]['wall'] - 1))
+            print('%-8s %9s %-16s %10.3f %12s %s' % (case['layout'], case['size'], name, item['wall'], peak, change))
+
+def load_results(revision):
+    path = os.path.join(RESULTS, revision + '.json')
+    if not os.path.exists(path):
+        raise ValueError("No benchmark results for revision %s in %s." % (revision, RESULTS))
+    with open(path, 'r') as reader:
+        return json.load(reader)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmarks the filename grouping of create_hyperstack on synthetic layouts.')
+    parser.add_argument('--layouts', default = ','.join(LAYOUTS), help = 'Comma-separated layouts: %s.' % ', '.join(LAYOUTS))
+    parser.add_argument('--sizes', default = '1000,10000,100000', help = 'Comma-separated numbers of filenames, up to 5000000.')
+    parser.add_argument('--memory', default = False, action = 'store_true', help = 'Also measure the peak memory of each phase with tracemalloc.')
+    parser.add_argument('--seed', default = 0, type = int)
+    parser.add_argument('--workdir', default = None, help = 'Directory, in which the synthetic files are created.')
+    parser.add_argument('--compare', default = None, help = 'Revision, whose stored results the new results are compared to.')
+    parser.add_argument('--no_save', default = False, action = 'store_true', help = 'Do not store the results.')
+    args = parser.parse_args()
+
+    reference = load_results(args.compare) if args.compare is not None else None
+    layouts = args.layouts.split(',')
+    sizes = [int(size) for size in args.sizes.split(',')]
+    for layout in layouts:
+        if layout not in LAYOUTS:
+            raise ValueError("Unknown layout %s. Choose from %s." % (layout, ', '.join(LAYOUTS)))
+
+    cases = []
+    ctx = multiprocessing.get_context('fork')
+    for layout, size in itertools.product(layouts, sizes):
+        queue = ctx.Queue()
+        proc = ctx.Process(target = run_case, args = (layout, size, args.workdir, args.seed, args.memory, queue))
+        proc.start()
+        while True:
+            try:
+                result = queue.get(timeout = 5)
+                break
+            except queues.Empty:
+                if not proc.is_alive():
+                    raise RuntimeError("The benchmark of %s with %s names failed." % (layout, size))
+        proc.join()
+        cases.append(result)
+        report([result], reference, header = len(cases) == 1)
+
+    revision = git_revision()
+    if not args.no_save:
+        os.makedirs(RESULTS, exist_ok = True)
+        path = os.path.join(RESULTS, revision + '.json')
+        with open(path, 'w') as writer:
+            json.dump({'revision': revision,
+                       'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'python': platform.python_version(),
+                       'machine': platform.machine(),
+                       'cpus': os.cpu_count(),
+                       'cases': cases}, writer, indent = 1)
+        print("Results written to %s" % path)
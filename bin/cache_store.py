@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+import os, json, time
+import shutil
+import tempfile
+import fcntl
+from contextlib import contextmanager
+
+def get_size(path):
+    """ Returns the total size of the files under path in bytes. Symlinks are not followed. """
+    if not os.path.isdir(path) or os.path.islink(path):
+        return os.lstat(path).st_size
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            size += os.lstat(os.path.join(root, name)).st_size
+    return size
+
+class CacheStore:
+    """
+    A directory of cache entries with a size bound. Each entry is a directory named after its key.
+    The index records the size and the last access time of every entry. When the total size exceeds
+    max_size, the least recently used entries are evicted. The index is locked with flock, so concurrent
+    processes can share the same cache directory. An entry that is in use is pinned with a shared flock on
+    its directory: eviction skips it, and invalidating or replacing it waits until it is released.
+    """
+    def __init__(self, root, max_size = None):
+        self.root = os.path.abspath(root)
+        self.max_size = max_size
+        os.makedirs(self.root, exist_ok = True)
+        self.index_path = os.path.join(self.root, 'index.json')
+        self.lock_path = os.path.join(self.root, '.lock')
+    @contextmanager
+    def __locked_index(self):
+        with open(self.lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if os.path.exists(self.index_path):
+                    with open(self.index_path, 'r') as reader:
+                        index = json.load(reader)
+                else:
+                    index = {}
+                yield index
+                tmp = self.index_path + '.%s.tmp' % os.getpid()
+                with open(tmp, 'w') as writer:
+                    json.dump(index, writer)
+                os.replace(tmp, self.index_path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+    def path(self, key):
+        return os.path.join(self.root, key)
+    def __lock_entry(self, key, block = True):
+        """ Takes the exclusive lock of an entry. Returns its file descriptor, or None if the entry is pinned and block is False. """
+        try:
+            fd = os.open(self.path(key), os.O_RDONLY)
+        except FileNotFoundError:
+            return None
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if block else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        return fd
+    def __remove_entry(self, key, block = True):
+        """ Removes the directory of an entry unless it is pinned and block is False. Returns True if it is gone. """
+        if not os.path.exists(self.path(key)):
+            return True
+        fd = self.__lock_entry(key, block)
+        if fd is None:
+            return False
+        try:
+            shutil.rmtree(self.path(key), ignore_errors = True)
+        finally:
+            os.close(fd)
+        return True
+    def lookup(self, key):
+        """ Returns the directory of the entry for key, or None if there is no such entry. """
+        with self.__locked_index() as index:
+            if key not in index:
+                return None
+            if not os.path.isdir(self.path(key)):
+                del index[key]
+                return None
+            index[key]['atime'] = time.time()
+        return self.path(key)
+    def contains(self, key):
+        """ True if there is an entry for key. Unlike lookup, the access time of the entry is not updated. """
+        with self.__locked_index() as index:
+            return key in index and os.path.isdir(self.path(key))
+    @contextmanager
+    def pin(self, key):
+        """
+        Yields the directory and the recorded size of the entry for key, or (None, None) if there is no such entry.
+        The entry is neither evicted nor removed until the block is left.
+        """
+        fd, size = None, None
+        with self.__locked_index() as index:
+            if key in index and os.path.isdir(self.path(key)):
+                fd = os.open(self.path(key), os.O_RDONLY)
+                fcntl.flock(fd, fcntl.LOCK_SH)
+                index[key]['atime'] = time.time()
+                size = index[key]['size']
+            elif key in index:
+                del index[key]
+        if fd is None:
+            yield None, None
+            return
+        try:
+            yield self.path(key), size
+        finally:
+            os.close(fd) ### releases the lock
+    def create(self):
+        """ Returns a staging directory, which becomes an entry when it is passed to commit. """
+        return tempfile.mkdtemp(prefix = '.staging_', dir = self.root)
+    def commit(self, key, staging):
+        """ Moves the staging directory into place as the entry for key and evicts old entries if needed. """
+        size = get_size(staging)
+        with self.__locked_index() as index:
+            dest = self.path(key)
+            self.__remove_entry(key)
+            os.rename(staging, dest)
+            index[key] = {'size': size, 'atime': time.time()}
+            self.__evict(index, keep = key)
+        return dest
+    def __evict(self, index, keep = None):
+        if self.max_size is None:
+            return
+        total = sum(item['size'] for item in index.values())
+        for key in sorted(index, key = lambda k: index[k]['atime']):
+            if total <= self.max_size:
+                break
+            if key == keep:
+                continue
+            if not self.__remove_entry(key, block = False): ### pinned
+                continue
+            total -= index.pop(key)['size']
+    def invalidate(self, key = None):
+        """ Removes the entry for key, or all entries if key is None. Returns the number of removed entries. """
+        with self.__locked_index() as index:
+            keys = list(index) if key is None else [k for k in (key,) if k in index]
+            for k in keys:
+                del index[k]
+                self.__remove_entry(k)
+        return len(keys)
+    def get_json(self, key, name = 'entry.json'):
+        path = self.lookup(key)
+        if path is None:
+            return None
+        try:
+            with open(os.path.join(path, name), 'r') as reader:
+                return json.load(reader)
+        except (OSError, ValueError):
+            self.invalidate(key)
+            return None
+    def put_json(self, key, obj, name = 'entry.json'):
+        staging = self.create()
+        with open(os.path.join(staging, name), 'w') as writer:
+            json.dump(obj, writer)
+        return self.commit(key, staging)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+"""
+A local cache of conversion outputs, keyed by the identity of the input and the effective conversion command.
+
+The identity of an input is its real path, size and modification time, optionally with a fast hash of its
+first and last HASH_BLOCK bytes. The names, sizes and modification times of the files a pattern file expands
+to are part of its identity. The command enters the key with the input path replaced by a
+placeholder and without the options that do not change the output, such as --max_workers. The entries are
+kept in a CacheStore, so the cache is bounded in size and the least recently used outputs are evicted first.
+"""
+
+import os, json
+import hashlib
+import shutil
+from cache_store import CacheStore, get_size
+from scratch_stage import get_pattern_files
+
+HASH_BLOCK = 1 << 20
+NEUTRAL_OPTIONS = {'--max_workers': 1, '--overwrite': 0} ### Options, which do not change the output, with their number of values.
+LINK_MODES = ('hardlink', 'symlink', 'copy')
+
+def fast_hash(path):
+    """ sha256 of the size and of the first and last HASH_BLOCK bytes of a file. """
+    digest = hashlib.sha256()
+    size = os.path.getsize(path)
+    digest.update(str(size).encode())
+    with open(path, 'rb') as reader:
+        digest.update(reader.read(HASH_BLOCK))
+        if size > HASH_BLOCK:
+            reader.seek(max(HASH_BLOCK, size - HASH_BLOCK))
+            digest.update(reader.read(HASH_BLOCK))
+    return digest.hexdigest()
+
+def get_identity(inps, use_hash = False):
+    ### Nextflow stages the inputs as symlinks in a new work directory on each run, so the link target identifies the input.
+    path = os.path.realpath(inps)
+    stat = os.stat(path)
+    identity = {'path': path, 'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+    if use_hash:
+        identity['hash'] = fast_hash(path)
+    if path.endswith('.pattern'):
+        with open(path, 'r') as reader:
+            identity['pattern'] = reader.read()
+        files = []
+        for fpath in get_pattern_files(path):
+            st = os.stat(fpath)
+            files.append((os.path.relpath(fpath, os.path.dirname(path)), st.st_size, st.st_mtime_ns))
+        identity['files'] = hashlib.sha256(json.dumps(sorted(files)).encode()).hexdigest()
+    return identity
+
+def get_effective_command(cmd, inps, outs):
+    """ The command without the neutral options, with the input replaced by a placeholder and the output reduced to its basename. """
+    effective = []
+    skip = 0
+    for item in cmd:
+        if skip > 0:
+            skip -= 1
+            continue
+        if item in NEUTRAL_OPTIONS:
+            skip = NEUTRAL_OPTIONS[item]
+            continue
+        if item == inps:
+            item = '{input}'
+        elif item == outs:
+            ### The name of the output is written into the OME-XML of an ome.tiff, so it is part of the key.
+            item = '{output}/' + os.path.basename(os.path.normpath(outs))
+        effective.append(item)
+    return effective
+
+def place(source, dest, mode = 'hardlink'):
+    """ Places the file or directory source at dest as a hardlink, a symlink or a copy. Hardlinks fall back to copies across filesystems. """
+    if mode == 'symlink':
+        os.symlink(os.path.abspath(source), dest)
+        return
+    def copy_function(src, dst):
+        if mode == 'hardlink':
+            try:
+                os.link(src, dst)
+                return dst
+            except OSError:
+                pass
+        return shutil.copy2(src, dst)
+    if os.path.isdir(source):
+        shutil.copytree(source, dest, copy_function = copy_function)
+    else:
+        copy_function(source, dest)
+
+def remove_output(outs):
+    if os.path.isdir(outs) and not os.path.islink(outs):
+        shutil.rmtree(outs)
+    elif os.path.lexists(outs):
+        os.remove(outs)
+
+class ConversionCache:
+    def __init__(self, root, max_size = None, use_hash = False, mode = 'hardlink'):
+        if mode not in LINK_MODES:
+            raise ValueError(f"The cache mode must be one of {', '.join(LINK_MODES)}, not {mode}.")
+        self.store = CacheStore(root, max_size = max_size)
+        self.use_hash = use_hash
+        self.mode = mode
+    def key(self, cmd, inps, outs):
+        obj = {'input': get_identity(inps, self.use_hash), 'command': get_effective_command(cmd, inps, outs)}
+        return hashlib.sha256(json.dumps(obj, sort_keys = True).encode()).hexdigest()
+    def contains(self, key):
+        return self.store.contains(key)
+    def fetch(self, key, outs):
+        """
+        Places the cached output for key at outs, replacing an earlier output. The entry is pinned while it is placed,
+        and a placed output, whose size differs from the recorded one, is removed. Returns False if there is no
+        such entry or the output could not be placed completely.
+        """
+        with self.store.pin(key) as (path, size):
+            if path is None:
+                return False
+            source = os.path.join(path, 'output')
+            complete = os.path.lexists(source)
+            if complete:
+                remove_output(outs)
+                place(source, outs, self.mode)
+                placed = source if self.mode == 'symlink' else outs
+                complete = get_size(placed) == size
+                if not complete:
+                    remove_output(outs)
+        if not complete:
+            self.store.invalidate(key)
+        return complete
+    def put(self, key, outs):
+        """ Stores the output at outs as the entry for key. The output is hardlinked into the cache where possible. """
+        staging = self.store.create()
+        try:
+            place(outs, os.path.join(staging, 'output'), 'hardlink')
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors = True)
+            raise
+        return self.store.commit(key, staging)
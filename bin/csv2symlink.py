@@ -1,9 +1,10 @@
 #!/usr/bin/env python
 
-import csv, os, sys, argparse, glob, shutil
+import csv, os, sys, argparse, glob, shutil, time
 from pathlib import Path
 
-from directory2symlink import makelinks
+from directory2symlink import synclinks, create_links, CommonDepth, WalkStats, get_filename, get_link_name, is_linked
+from manifest_db import read_rows
 
 
 parser = argparse.ArgumentParser()
@@ -13,27 +14,14 @@ parser.add_argument('relpath_column')
 parser.add_argument('dest_path')
 parser.add_argument('--contains', default = None)
 parser.add_argument('--ignores', default = None)
+parser.add_argument('--sync', default = False, action = 'store_true',
+                    help = 'Update the links in dest_path in place: create the missing ones, fix wrong targets and remove stale ones.')
+parser.add_argument('--workers', default = 8, type = int,
+                    help = 'Number of threads that create the links.')
 
-
-if __name__ == '__main__':
-    args = parser.parse_args()
-    result_dict_list = []
-    csv_file_path = args.csv_file_path
-
-    dircol = args.root_column
-    namecol = args.relpath_column
-    destdir = args.dest_path
-
-    os.makedirs(destdir, exist_ok = True)
-
-    result_dict_list = []
-    with open(csv_file_path, 'r') as csv_file:
-        csv_reader = csv.DictReader(csv_file)
-        for row in csv_reader:
-            result_dict_list.append(row)
-
-    pathlist = []
-    for dictitem in result_dict_list:
+def iter_paths(csv_file_path, dircol, namecol):
+    """ Yields the path of the file in each row of the csv file or manifest. """
+    for dictitem in read_rows(csv_file_path):
         if dircol in dictitem:
             root = dictitem[dircol].replace('root/', '')
         elif dircol in ("auto", None, ""):
@@ -52,10 +40,62 @@ if __name__ == '__main__':
             fpath = relpath
         else:
             fpath = os.path.join(root, relpath)
-        pathlist.append(fpath)
+        yield fpath
+
+def stage_links(csv_file_path, dircol, namecol, destdir, contains = None, ignores = None, sync = False, workers = 1, chunksize = 10000):
+    """
+    Links the files listed in a csv file or manifest into destdir, with the same link names as makelinks.
+    The rows are streamed twice: the first pass finds the duplicate filenames and the common root of the
+    paths, the second creates the links in chunks of chunksize on a pool of workers threads. Only the
+    filenames are kept in memory. With sync, the links are collected and passed to synclinks instead.
+    """
+    stats = WalkStats(workers)
+    stats.walker = 'csv'
+    t0 = time.perf_counter()
+    seen, duplicates = set(), set()
+    common = CommonDepth()
+    for fpath in iter_paths(csv_file_path, dircol, namecol):
+        common.add(fpath)
+        fname = get_filename(fpath)
+        if fname in seen:
+            duplicates.add(fname)
+        else:
+            seen.add(fname)
+    del seen
+    depth = common.depth() if len(duplicates) > 0 else None
+    stats.walk_time = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    links = []
+    counts = None
+    for fpath in iter_paths(csv_file_path, dircol, namecol):
+        fname = get_filename(fpath)
+        if not is_linked(fname, contains, ignores):
+            continue
+        links.append((fpath, get_link_name(fpath, fname, destdir, depth if fname in duplicates else None)))
+        if (not sync) and (len(links) >= chunksize):
+            create_links(links, workers, stats)
+            links = []
+    if sync:
+        counts = synclinks(destdir, links, workers, stats)
+        print(', '.join(['%s: %s' % item for item in counts.items()]))
+    else:
+        create_links(links, workers, stats)
+    stats.link_time = time.perf_counter() - t0
+    print(stats.report())
+    return destdir
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
 
-    makelinks(pathlist, destdir,
-              replace_outpath = False,
-              contains = args.contains,
-              ignores = args.ignores)
+    os.makedirs(args.dest_path, exist_ok = True)
 
+    stage_links(args.csv_file_path,
+                args.root_column,
+                args.relpath_column,
+                args.dest_path,
+                contains = args.contains,
+                ignores = args.ignores,
+                sync = args.sync,
+                workers = args.workers)
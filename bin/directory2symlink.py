@@ -1,14 +1,262 @@
 #!/usr/bin/env python
-import os, sys, argparse, glob, json, copy
+import os, sys, argparse, glob, json, copy, time
 import shutil
+import fnmatch
 from pathlib import Path
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+class WalkStats:
+    """ Counts the filesystem calls and the time spent by makelinks. """
+    def __init__(self, workers = 1):
+        self.workers = workers
+        self.walker = 'scandir'
+        self.directories = 0
+        self.entries = 0
+        self.stats = 0 ### Entries whose type needs a stat call: symlinks, which are followed as glob does.
+        self.symlinks = 0
+        self.walk_time = 0.
+        self.link_time = 0.
+    def report(self):
+        return ("%s walk: %s directories, %s entries, %s stat calls in %.3f s; %s symlink calls in %.3f s with %s workers"
+                % (self.walker, self.directories, self.entries, self.stats, self.walk_time, self.symlinks, self.link_time, self.workers))
+
+def scan_directory(dirname, pattern, files_only, recursive):
+    """
+    Lists a single directory as glob does: hidden entries are skipped unless the pattern starts with a dot,
+    and hidden directories are never descended into. The entry types come from d_type, so only symlinks
+    need a stat call.
+    Returns the matching paths, the subdirectories to descend into if recursive, and the counts of entries and stat calls.
+    """
+    matches, subdirs = [], []
+    nentries, nstats = 0, 0
+    show_hidden = pattern.startswith('.')
+    try:
+        with os.scandir(dirname or os.curdir) as entries:
+            for entry in entries:
+                nentries += 1
+                name = entry.name
+                is_hidden = name.startswith('.')
+                if is_hidden and not show_hidden:
+                    continue
+                if entry.is_symlink():
+                    nstats += 1
+                path = os.path.join(dirname, name)
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if recursive and is_dir and not is_hidden:
+                    subdirs.append(path)
+                if fnmatch.fnmatch(name, pattern):
+                    if (not files_only) or entry.is_file():
+                        matches.append(path)
+    except OSError:
+        pass
+    return matches, subdirs, nentries, nstats
+
+def split_pattern(inpath):
+    """
+    Splits a path pattern into the directory to walk, the filename pattern and whether to descend into
+    subdirectories. Returns None for the patterns that are left to glob.
+    """
+    if '**' in inpath:
+        root, _, rest = inpath.partition('**')
+        if (root != '' and not root.endswith('/')) or glob.has_magic(root) or ('**' in rest):
+            return None
+        if rest == '':
+            pattern = '*'
+        elif rest.startswith('/') and ('/' not in rest[1:]) and (rest[1:] != ''):
+            pattern = rest[1:]
+        else:
+            return None
+        return root.rstrip('/') if root.rstrip('/') != '' else root, pattern, True
+    dirname, pattern = os.path.split(inpath)
+    if glob.has_magic(dirname):
+        return None
+    return dirname, pattern, False
+
+def walk(dirname, pattern, files_only = False, recursive = False, workers = 1, stats = None):
+    """
+    Lists the paths in dirname whose names match pattern, descending into subdirectories if recursive.
+    The directories are scanned concurrently by a pool of workers threads. The paths are returned
+    directory by directory, with the directories in depth-first order.
+    """
+    if stats is None:
+        stats = WalkStats(workers)
+    results, children = {}, {}
+    with ThreadPoolExecutor(max_workers = max(1, workers)) as executor:
+        pending = {executor.submit(scan_directory, dirname, pattern, files_only, recursive): dirname}
+        while len(pending) > 0:
+            done, _ = wait(pending, return_when = FIRST_COMPLETED)
+            for future in done:
+                path = pending.pop(future)
+                matches, subdirs, nentries, nstats = future.result()
+                stats.directories += 1
+                stats.entries += nentries
+                stats.stats += nstats
+                results[path], children[path] = matches, subdirs
+                for subdir in subdirs:
+                    pending[executor.submit(scan_directory, subdir, pattern, files_only, recursive)] = subdir
+    paths = []
+    stack = [dirname]
+    while len(stack) > 0:
+        path = stack.pop()
+        paths.extend(results[path])
+        stack.extend(reversed(children[path]))
+    return paths
+
+def create_links(links, workers = 1, stats = None):
+    """
+    Creates the (source, sink) symlinks in chunks on a pool of workers threads. Existing sinks are kept,
+    and the first source of a sink wins, as in the serial loop.
+    """
+    unique = {}
+    for source, sink in links:
+        unique.setdefault(sink, source)
+    items = list(unique.items())
+    def link_chunk(chunk):
+        for sink, source in chunk:
+            try:
+                os.symlink(source, sink)
+            except FileExistsError:
+                pass
+    chunksize = 256
+    chunks = [items[i:i + chunksize] for i in range(0, len(items), chunksize)]
+    if workers > 1 and len(chunks) > 1:
+        with ThreadPoolExecutor(max_workers = workers) as executor:
+            list(executor.map(link_chunk, chunks))
+    else:
+        for chunk in chunks:
+            link_chunk(chunk)
+    if stats is not None:
+        stats.symlinks += len(items)
+
+def get_component(item):
+    return '/' if item == '' else item
+
+def get_filename(path):
+    return get_component(path.rpartition('/')[2])
+
+class CommonDepth:
+    """
+    Finds the index of the first path component that is not shared by all paths, limited to the index
+    of the last component of the shortest path, in a single streaming pass over the paths.
+    Only the common string prefix of the paths seen so far is kept. Its last component is complete
+    only if every path ends or has a separator right after it. All earlier paths contain the current
+    prefix, so when the prefix shrinks, they share the character that follows the new prefix and
+    a single comparison checks all of them.
+    """
+    def __init__(self):
+        self.prefix = None
+        self.complete = True
+        self.shortest = None
+    def add(self, path):
+        ncomponents = path.count('/') + 1
+        if self.prefix is None:
+            self.prefix = path
+            self.shortest = ncomponents
+            return
+        self.shortest = min(self.shortest, ncomponents)
+        prefix = os.path.commonprefix([self.prefix, path])
+        n = len(prefix)
+        if n < len(self.prefix):
+            self.complete = self.prefix[n] == '/'
+            self.prefix = prefix
+        self.complete = self.complete and ((len(path) == n) or (path[n] == '/'))
+    def depth(self):
+        common = self.prefix.count('/') + (1 if self.complete else 0)
+        return min(common, self.shortest - 1)
+
+def get_common_depth(paths):
+    common = CommonDepth()
+    for path in paths:
+        common.add(path)
+    return common.depth()
+
+def get_link_name(path, fname, outpath, depth = None):
+    """
+    The symlink path in outpath for path. depth is None if the filename of path is unique, in which case
+    the link is named after the file. Otherwise the path components from depth on are joined with underscores.
+    """
+    if depth is None:
+        return os.path.join(outpath, fname).replace(' ', '_')
+    basename = '_'.join([get_component(item) for item in path.split('/')[depth:]])
+    return os.path.join(outpath, basename).replace(' ', '_')
+
+def is_linked(name, contains = None, ignores = None):
+    """ The contains/ignores filter of makelinks. If both are given, only ignores applies. """
+    if contains in (None, 'None', '') and ignores in (None, 'None', ''):
+        return True
+    elif ignores not in (None, 'None', ''):
+        return ignores not in name
+    return contains in name
+
+def plan_links(paths, outpath):
+    """
+    Returns the symlink paths in outpath for the given paths, and the filenames of the paths.
+    A file is linked under its filename unless another path has the same filename, in which case
+    its path components after the common root are joined with underscores.
+    """
+    if len(paths) == 0:
+        return [], []
+    filenames = [get_filename(path) for path in paths]
+    counts = Counter(filenames)
+    i = None
+    outfiles = []
+    for path, fname in zip(paths, filenames):
+        if counts[fname] > 1:
+            if i is None:
+                i = get_common_depth(paths)
+            outfiles.append(get_link_name(path, fname, outpath, i))
+        else:
+            outfiles.append(get_link_name(path, fname, outpath))
+    return outfiles, filenames
+
+def synclinks(outpath, links, workers = 1, stats = None):
+    """
+    Brings the symlinks in outpath in line with links, a list of (source, sink) pairs.
+    Missing links are created, links with a different target are replaced and links in outpath that are
+    not in the list are removed. Other entries in outpath are left alone. Returns the count of each action.
+    """
+    counts = {'created': 0, 'fixed': 0, 'removed': 0, 'unchanged': 0, 'conflicts': 0}
+    desired = {}
+    for source, sink in links:
+        desired.setdefault(sink, source) ### As in makelinks, the first source of a sink wins.
+    existing = {}
+    with os.scandir(outpath) as entries:
+        for entry in entries:
+            if entry.is_symlink():
+                existing[os.path.join(outpath, entry.name)] = entry.path
+    for sink, path in existing.items():
+        if sink not in desired:
+            os.unlink(path)
+            counts['removed'] += 1
+    missing = []
+    for sink, source in desired.items():
+        if sink in existing or os.path.islink(sink):
+            if os.readlink(sink) == source:
+                counts['unchanged'] += 1
+                continue
+            os.unlink(sink)
+            missing.append((source, sink))
+            counts['fixed'] += 1
+        elif os.path.exists(sink):
+            counts['conflicts'] += 1
+        else:
+            missing.append((source, sink))
+            counts['created'] += 1
+    create_links(missing, workers, stats)
+    return counts
 
 def makelinks(inpath,
               outpath,
               contains = None,
               ignores = None,
               replace_outpath = True,
-              files_only = 'False' # If true, do not symlink sub-directories.
+              files_only = 'False', # If true, do not symlink sub-directories.
+              sync = False, # If true, update an existing outpath in place instead of replacing it.
+              workers = 1 # Number of threads that scan directories and create links.
               ):
 
     if isinstance(inpath, Path):
@@ -18,77 +266,56 @@ def makelinks(inpath,
 
     # print(inpath)
 
+    stats = WalkStats(workers)
+    t0 = time.perf_counter()
     if isinstance(inpath, (list, tuple)):
         paths = inpath
+        stats.walker = 'no'
     elif os.path.isfile(inpath):
         paths = glob.glob(inpath)
+        stats.walker = 'no'
     else:
         if '**' in inpath:
             files_only = 'True' ## With the recursive option, do not symlink sub-directories.
-            paths = glob.glob(inpath, recursive = True)
+            pattern = inpath
         elif '*' in inpath:
-            paths = glob.glob(inpath)
-            # print(inpath, paths)
+            pattern = inpath
+        else:
+            pattern = os.path.join(inpath, '*')
+        files_only = files_only in ('True', True)
+        parts = split_pattern(pattern)
+        if parts is None: ### Patterns with wildcards in the directory part are left to glob.
+            stats.walker = 'glob'
+            paths = glob.glob(pattern, recursive = True)
+            if files_only:
+                paths = [path for path in paths if os.path.isfile(path)]
         else:
-            paths = glob.glob(os.path.join(inpath, '*'))
+            dirname, namepattern, recursive = parts
+            paths = walk(dirname, namepattern, files_only, recursive, workers, stats)
     # print(paths)
+    stats.walk_time = time.perf_counter() - t0
 
-    if files_only in ('True', True):
+    if (files_only in ('True', True)) and (stats.walker == 'no'):
         paths = [path for path in paths if os.path.isfile(path)]
 
-    fpaths = copy.deepcopy(paths)
-    # print(fpaths)
-    fpaths_s = [fpath.split('/') for fpath in fpaths]
-    # print(fpaths_s)
-    for i, path in enumerate(fpaths_s):
-        fpath = ['/' if item == '' else item for item in path]
-        fpaths_s[i] = fpath
-    # print(fpaths_s)
-    l = len(fpaths_s[0])
-    shortest = fpaths_s[0]
-    for fpath in fpaths_s:
-        if len(fpath) < l:
-            shortest = fpath
-            l = len(fpath)
-    for i in range(l):
-        fields = [path[i] for path in fpaths_s]
-        if all([field == shortest[i] for field in fields]):
-            pass
-        else:
-            break
+    outfiles, filenames = plan_links(paths, outpath)
+    fpaths = paths
 
-    basenames = ['_'.join(item[i:]) for item in fpaths_s]
-    fnames = [item[-1] for item in fpaths_s]
-
-    outfiles = []
-    for i, basename in enumerate(basenames):
-        names = copy.deepcopy(fnames)
-        names.pop(i)
-        fname = fnames[i]
-        # print(fname)
-        if fname in names:
-            outfiles.append(os.path.join(outpath, basename).replace(' ', '_'))
-        else:
-            outfiles.append(os.path.join(outpath, fname).replace(' ', '_'))
-    ###
-    filenames = [item[-1] for item in fpaths_s]
-
-    if replace_outpath:
+    if replace_outpath and not sync:
         if os.path.exists(outpath):
             shutil.rmtree(outpath)
     os.makedirs(outpath, exist_ok=True)
 
-    symlink = lambda source, sink: os.symlink(source, sink) if not os.path.exists(sink) else None
-
-    for path, name, outfile in zip(fpaths, filenames, outfiles):
-        if contains in (None, 'None', '') and ignores in (None, 'None', ''):
-            symlink(path, outfile)
-        elif ignores not in (None, 'None', ''):
-            if ignores not in name:
-                symlink(path, outfile)
-        elif contains not in (None, 'None', ''):
-            if contains in name:
-                symlink(path, outfile)
+    links = [(path, outfile) for path, name, outfile in zip(fpaths, filenames, outfiles) if is_linked(name, contains, ignores)]
+
+    t0 = time.perf_counter()
+    if sync:
+        counts = synclinks(outpath, links, workers, stats)
+        print(', '.join(['%s: %s' % item for item in counts.items()]))
+    else:
+        create_links(links, workers, stats)
+    stats.link_time = time.perf_counter() - t0
+    print(stats.report())
     return outpath
 
 
@@ -101,6 +328,12 @@ if __name__ == '__main__':
     parser.add_argument('--contains', default=None)
     parser.add_argument('--ignores', default=None)
     parser.add_argument('--files_only', default = 'False', choices = ('True', 'False'))
+    parser.add_argument('--out_path', default = 'symlinks')
+    parser.add_argument('--sync', default = False, action = 'store_true',
+                        help = 'Update the links in out_path in place: create the missing ones, fix wrong targets and remove stale ones.')
+    parser.add_argument('--workers', default = 8, type = int,
+                        help = 'Number of threads that scan directories and create links. Raise it for networked storage.')
     args = parser.parse_args()
 
-    makelinks(args.in_path, 'symlinks', contains=args.contains, ignores=args.ignores, files_only=args.files_only)
+    makelinks(args.in_path, args.out_path, contains=args.contains, ignores=args.ignores, files_only=args.files_only, sync=args.sync,
+              workers=args.workers)
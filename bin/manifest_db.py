@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+"""
+A compact, indexed alternative to the csv manifests.
+
+The manifest is an SQLite database built once from a csv file. Columns whose values repeat, typically the
+root paths, are dictionary-encoded: the rows table keeps an integer id and the values are stored once in a
+separate table. The csv readers of the pipeline (parse_csv, rewrite_csv, csv2symlink and the FilelistGrouper
+with use_list) go through read_rows, which reads such a manifest instead of the csv whenever the path ends
+with one of MANIFEST_EXTENSIONS.
+
+    manifest_db.py build FileList.csv FileList.sqlite
+    manifest_db.py verify FileList.csv FileList.sqlite
+"""
+
+import csv, os, sys, json, argparse
+import itertools
+import sqlite3
+import pathlib
+
+MANIFEST_EXTENSIONS = ('.sqlite', '.db')
+SAMPLE_SIZE = 10000 ### The number of rows, from which the repeating columns are detected.
+
+def is_manifest(path):
+    return str(path).lower().endswith(MANIFEST_EXTENSIONS)
+
+def read_csv_rows(csv_path, sniff = False):
+    with open(csv_path, 'r', newline = '') as csv_file:
+        if sniff:
+            dialect = csv.Sniffer().sniff(csv_file.read(1024))
+            csv_file.seek(0)
+            csv_reader = csv.DictReader(csv_file, dialect = dialect)
+        else:
+            csv_reader = csv.DictReader(csv_file)
+        for row in csv_reader:
+            yield row
+
+def read_rows(path, sniff = False):
+    """ Yields the rows of a manifest or a csv file as dicts, depending on the extension of path. """
+    if is_manifest(path):
+        with ManifestReader(path) as reader:
+            yield from reader
+    else:
+        yield from read_csv_rows(path, sniff)
+
+def read_column(path, colname):
+    """ Yields the values of a single column of a manifest or a csv file. """
+    if is_manifest(path):
+        with ManifestReader(path) as reader:
+            yield from reader.column(colname)
+    else:
+        for row in read_csv_rows(path):
+            yield row[colname]
+
+def _quote(name):
+    return '"%s"' % name.replace('"', '""')
+
+def detect_dict_columns(sample, fieldnames):
+    """ Columns with fewer unique values than half the number of sampled rows are dictionary-encoded. """
+    if len(sample) == 0:
+        return []
+    return [name for name in fieldnames if len(set(row[name] for row in sample)) * 2 <= len(sample)]
+
+def build_manifest(csv_path, db_path, dict_columns = None, index_columns = (), sniff = False):
+    """
+    Converts csv_path into the manifest db_path and returns the number of rows.
+    dict_columns are dictionary-encoded; by default they are detected from the first SAMPLE_SIZE rows.
+    An index is created for each of index_columns.
+    """
+    rows = read_csv_rows(csv_path, sniff)
+    sample = list(itertools.islice(rows, SAMPLE_SIZE))
+    if len(sample) > 0:
+        fieldnames = list(sample[0].keys())
+    else:
+        with open(csv_path, 'r', newline = '') as csv_file:
+            fieldnames = next(csv.reader(csv_file), [])
+    if None in fieldnames:
+        raise ValueError(f"The csv file {csv_path} has rows with more fields than its header.")
+    if dict_columns is None:
+        dict_columns = detect_dict_columns(sample, fieldnames)
+    for name in list(dict_columns) + list(index_columns):
+        if name not in fieldnames:
+            raise ValueError(f"{name} could not be found in the column names.")
+
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute('PRAGMA journal_mode = OFF')
+        conn.execute('PRAGMA synchronous = OFF')
+        conn.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)')
+        columns = []
+        for i, name in enumerate(fieldnames):
+            if name in dict_columns:
+                conn.execute('CREATE TABLE dict_%s (id INTEGER PRIMARY KEY, value TEXT UNIQUE)' % i)
+                columns.append('c%s INTEGER' % i)
+            else:
+                columns.append('c%s TEXT' % i)
+        conn.execute('CREATE TABLE rows (%s)' % ', '.join(columns))
+
+        encoders = {i: {} for i, name in enumerate(fieldnames) if name in dict_columns}
+        def encode(row):
+            values = []
+            for i, name in enumerate(fieldnames):
+                value = row[name]
+                if i in encoders:
+                    codes = encoders[i]
+                    if value not in codes:
+                        codes[value] = len(codes)
+                        conn.execute('INSERT INTO dict_%s (id, value) VALUES (?, ?)' % i, (codes[value], value))
+                    value = codes[value]
+                values.append(value)
+            return values
+        placeholders = ', '.join(['?'] * len(fieldnames))
+        count = 0
+        rows = itertools.chain(sample, rows)
+        while True:
+            chunk = [encode(row) for row in itertools.islice(rows, 10000)]
+            if len(chunk) == 0:
+                break
+            conn.executemany('INSERT INTO rows VALUES (%s)' % placeholders, chunk)
+            count += len(chunk)
+        for name in index_columns:
+            i = fieldnames.index(name)
+            conn.execute('CREATE INDEX index_%s ON rows (c%s)' % (i, i))
+        meta = {'fieldnames': fieldnames, 'dict_columns': [name for name in fieldnames if name in dict_columns],
+                'rows': count, 'source': os.path.abspath(csv_path)}
+        conn.executemany('INSERT INTO meta VALUES (?, ?)', [(key, json.dumps(value)) for key, value in meta.items()])
+        conn.commit()
+    finally:
+        conn.close()
+    return count
+
+class ManifestReader:
+    """ Reads the rows of a manifest in their original order. The dictionaries of the encoded columns are loaded once. """
+    def __init__(self, db_path):
+        if not os.path.exists(db_path):
+            raise FileNotFoundError(db_path)
+        self.conn = sqlite3.connect(pathlib.Path(db_path).resolve().as_uri() + '?mode=ro', uri = True)
+        meta = dict(self.conn.execute('SELECT key, value FROM meta'))
+        self.fieldnames = json.loads(meta['fieldnames'])
+        self.dict_columns = json.loads(meta['dict_columns'])
+        self.nrows = json.loads(meta['rows'])
+        self.decoders = {}
+        for name in self.dict_columns:
+            i = self.fieldnames.index(name)
+            self.decoders[i] = dict(self.conn.execute('SELECT id, value FROM dict_%s' % i))
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        self.close()
+    def close(self):
+        self.conn.close()
+    def __len__(self):
+        return self.nrows
+    def __decode(self, i, value):
+        return self.decoders[i][value] if i in self.decoders else value
+    def __iter__(self):
+        fieldnames = self.fieldnames
+        decoders = [self.decoders.get(i) for i in range(len(fieldnames))]
+        for record in self.conn.execute('SELECT * FROM rows ORDER BY rowid'):
+            yield {name: (value if decoder is None else decoder[value]) for name, value, decoder in zip(fieldnames, record, decoders)}
+    def column(self, colname):
+        """ Yields the values of a single column without decoding the other ones. """
+        if colname not in self.fieldnames:
+            raise ValueError(f"{colname} could not be found in the column names.")
+        i = self.fieldnames.index(colname)
+        for (value,) in self.conn.execute('SELECT c%s FROM rows ORDER BY rowid' % i):
+            yield self.__decode(i, value)
+    def lookup(self, colname, value):
+        """ Yields the rows, in which colname equals value. """
+        if colname not in self.fieldnames:
+            raise ValueError(f"{colname} could not be found in the column names.")
+        i = self.fieldnames.index(colname)
+        if i in self.decoders:
+            ### The UNIQUE constraint indexes the values of the dictionary.
+            code = self.conn.execute('SELECT id FROM dict_%s WHERE value = ?' % i, (value,)).fetchone()
+            if code is None:
+                return
+            value = code[0]
+        fieldnames = self.fieldnames
+        for record in self.conn.execute('SELECT * FROM rows WHERE c%s = ? ORDER BY rowid' % i, (value,)):
+            yield {name: self.__decode(j, item) for j, (name, item) in enumerate(zip(fieldnames, record))}
+
+def verify_manifest(csv_path, db_path, sniff = False):
+    """ Compares every row of the manifest with the csv file. Returns the number of rows, raises a ValueError on the first difference. """
+    count = 0
+    sentinel = object()
+    for count, (a, b) in enumerate(itertools.zip_longest(read_csv_rows(csv_path, sniff), read_rows(db_path), fillvalue = sentinel), 1):
+        if a is sentinel or b is sentinel:
+            raise ValueError(f"{csv_path} and {db_path} have a different number of rows.")
+        if a != b:
+            raise ValueError(f"Row {count} differs: {a} != {b}")
+    return count
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Converts csv manifests into indexed SQLite manifests.')
+    subparsers = parser.add_subparsers(dest = 'command', required = True)
+    build = subparsers.add_parser('build', help = 'Convert a csv file into a manifest.')
+    build.add_argument('csv_path')
+    build.add_argument('db_path')
+    build.add_argument('--dict_columns', default = None, help = 'Comma-separated columns to dictionary-encode. Detected if not given.')
+    build.add_argument('--index_columns', default = '', help = 'Comma-separated columns to index for lookups.')
+    build.add_argument('--sniff', default = False, action = 'store_true', help = 'Sniff the csv dialect as parse_csv does.')
+    build.add_argument('--verify', default = False, action = 'store_true', help = 'Compare the manifest with the csv file after building it.')
+    verify = subparsers.add_parser('verify', help = 'Compare a manifest with the csv file it was built from.')
+    verify.add_argument('csv_path')
+    verify.add_argument('db_path')
+    verify.add_argument('--sniff', default = False, action = 'store_true')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        dict_columns = None if args.dict_columns is None else [name for name in args.dict_columns.split(',') if name != '']
+        index_columns = [name for name in args.index_columns.split(',') if name != '']
+        count = build_manifest(args.csv_path, args.db_path, dict_columns, index_columns, args.sniff)
+        print(f"{count} rows written to {args.db_path}")
+    if args.command == 'verify' or args.verify:
+        count = verify_manifest(args.csv_path, args.db_path, args.sniff)
+        print(f"{count} rows verified against {args.csv_path}")
@@ -37,8 +37,9 @@ if __name__ == "__main__":
         if not os.path.exists(destpath):
             shutil.copy(fpath, destpath)
 
-    # Transfer the conversion script to the execution folder:
-    shutil.copy(f"{scriptpath}/run_conversion.py", f"{binpath}/run_conversion.py")
+    # Transfer the conversion script and the modules it imports to the execution folder:
+    for fname in ("run_conversion.py", "conversion_cache.py", "cache_store.py", "scratch_stage.py"):
+        shutil.copy(f"{scriptpath}/{fname}", f"{binpath}/{fname}")
 
     cmd = [os.path.join(scriptpath, "batchconvert"), *sys.argv[1:]]
     interactive_commands = ['configure_s3_remote', 'configure_ometiff', 'configure_omezarr', 'configure_slurm']
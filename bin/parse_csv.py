@@ -1,8 +1,13 @@
 #!/usr/bin/env python
 
 import copy, csv, os, sys, argparse
+import functools
 
+from manifest_db import read_rows
+
+@functools.lru_cache(maxsize = 4096)
 def validate_path(ref_dir, pth): # ref_dir is where the csv file is located.
+    """ Most rows share the same root, so each root is validated only once. """
     if pth is None or pth == '':
         pth = ''
     if pth.startswith('/'):
@@ -23,54 +28,43 @@ def validate_path(ref_dir, pth): # ref_dir is where the csv file is located.
                 raise ValueError(f"The path {jnpth} is not valid.")
     return pth
 
-def robust_parse_csv(csv_sourcepath: str = "",
-                     csv_destpath: str = "",
-                     colname_parent: str = "",
-                     colname_relative: str = "",
-                     pattern: str = None,
-                     rpattern: str = None,
-                     endpoint: str = "local"
-                     ):
-
+def parse_rows(rows,
+               ref_dir: str = "",
+               colname_parent: str = "",
+               colname_relative: str = "",
+               pattern: str = None,
+               rpattern: str = None,
+               endpoint: str = "local"
+               ):
+    """
+    Yields the rows that pass the pattern filters, with the parent and relative path columns replaced by
+    RootOriginal and ImageNameOriginal. Rows are processed one at a time.
+    """
     fieldnames = None
+    no_parent = colname_parent == '' or colname_parent =="null" or colname_parent is None
+    if colname_relative == '' or colname_relative =="null" or colname_relative is None:
+        raise ValueError(f"The relative paths cannot be an empty string or None. Individual files must be specified.")
 
-    dictlist = []
-    with open(csv_sourcepath, 'r') as csv_file:
-        dialect = csv.Sniffer().sniff(csv_file.read(1024))
-        csv_file.seek(0)
-        csv_reader = csv.DictReader(csv_file, dialect=dialect)
-        for row in csv_reader:
-            dictlist.append(row)
-
-    newlist = []
-    for dictitem in dictlist:
+    for dictitem in rows:
         if fieldnames is None:
             fieldnames = list(dictitem.keys())
+            if not no_parent and colname_parent not in dictitem:
+                print(f"keys are: {fieldnames}")
+                raise ValueError(f"{colname_parent} could not be found in the column names.")
+            if colname_relative not in dictitem:
+                raise ValueError(f"{colname_relative} could not be found in the column names.")
         else:
             assert fieldnames == list(dictitem.keys())
 
-        if colname_parent == '' or colname_parent =="null" or colname_parent is None:
-            rootpath = ''
-        elif colname_parent in dictitem.keys():
-            rootpath = dictitem[colname_parent]
-        else:
-            print(f"keys are: {list(dictitem.keys())}")
-            raise ValueError(f"{colname_parent} could not be found in the column names.")
-
-        if colname_relative == '' or colname_relative =="null" or colname_relative is None:
-            raise ValueError(f"The relative paths cannot be an empty string or None. Individual files must be specified.")
-        elif colname_relative in dictitem.keys():
-            relpath = dictitem[colname_relative]
-        else:
-            raise ValueError(f"{colname_relative} could not be found in the column names.")
+        rootpath = '' if no_parent else dictitem[colname_parent]
+        relpath = dictitem[colname_relative]
 
         if endpoint == "local":
-            rootpath = validate_path(os.path.dirname(csv_sourcepath), rootpath)
+            rootpath = validate_path(ref_dir, rootpath)
         if relpath.startswith('/'): relpath = relpath[1:]
         fullpath = os.path.join(rootpath, relpath)
 
-        newroot = os.path.dirname(fullpath)
-        filename = os.path.basename(fullpath)
+        newroot, filename = os.path.split(fullpath)
 
         fnameok = True
         if pattern is not None:
@@ -84,17 +78,43 @@ def robust_parse_csv(csv_sourcepath: str = "",
                 dictitem.pop(colname_parent)
             dictitem.pop(colname_relative)
             dictitem.update({f"RootOriginal": newroot, f"ImageNameOriginal": filename})
-            newlist.append(dictitem)
+            yield dictitem
 
-    new_fieldnames = list(newlist[0].keys())
+def write_rows(rows, csv_destpath):
+    """ Writes rows to csv_destpath as they arrive, taking the header from the first row. Returns the number of rows. """
+    count = 0
     os.makedirs(os.path.dirname(f'./{csv_destpath}'), exist_ok = True)
-
     with open(csv_destpath, 'w', newline='') as csv_file:
-        csv_writer = csv.DictWriter(csv_file, fieldnames = new_fieldnames)
-        csv_writer.writeheader()
-        csv_writer.writerows(newlist)
+        csv_writer = None
+        for row in rows:
+            if csv_writer is None:
+                csv_writer = csv.DictWriter(csv_file, fieldnames = list(row.keys()))
+                csv_writer.writeheader()
+            csv_writer.writerow(row)
+            count += 1
+    if count == 0:
+        os.remove(csv_destpath)
+        raise ValueError(f"No rows were left to write to {csv_destpath}.")
+    return count
 
-    return newlist
+def robust_parse_csv(csv_sourcepath: str = "",
+                     csv_destpath: str = "",
+                     colname_parent: str = "",
+                     colname_relative: str = "",
+                     pattern: str = None,
+                     rpattern: str = None,
+                     endpoint: str = "local"
+                     ):
+    """ Streams the rows of csv_sourcepath through parse_rows into csv_destpath. Returns the number of rows written. """
+    rows = parse_rows(read_rows(csv_sourcepath, sniff = True),
+                      os.path.dirname(csv_sourcepath),
+                      colname_parent,
+                      colname_relative,
+                      pattern,
+                      rpattern,
+                      endpoint
+                      )
+    return write_rows(rows, csv_destpath)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -106,11 +126,11 @@ if __name__ == "__main__":
     parser.add_argument('--reject_pattern', '-rp', default=None)
     parser.add_argument('--endpoint', default = "local")
     args = parser.parse_args()
-    filelist = robust_parse_csv(args.csv_source_path,
-                                args.csv_dest_path,
-                                args.colname_parent,
-                                args.colname_relative,
-                                args.pattern,
-                                args.reject_pattern,
-                                args.endpoint
-                                )
\ No newline at end of file
+    nrows = robust_parse_csv(args.csv_source_path,
+                             args.csv_dest_path,
+                             args.colname_parent,
+                             args.colname_relative,
+                             args.pattern,
+                             args.reject_pattern,
+                             args.endpoint
+                             )
\ No newline at end of file
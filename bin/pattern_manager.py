@@ -1,13 +1,23 @@
 #!/usr/bin/env python
-import os, re, csv
+import os, re, csv, json, io, time
 import shutil
 import copy
+import heapq, tempfile
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from manifest_db import read_column
 from collections import Counter
-import itertools
+from collections.abc import Sequence
+from array import array
+import itertools, operator
 
 transpose_list = lambda l: list(map(list, zip(*l)))
 get_numerics = lambda string: list(re.findall(r'\d+', string))
+numeric_pattern = re.compile(r'\d+')
 get_alpha = lambda string: ''.join([i for i in string if not i.isnumeric()])
+ascii_digits = str.maketrans('', '', '0123456789')
+SORT_BUFFER_SIZE = 1000000 ### The number of filenames that are sorted in memory before spilling sorted runs to disk.
+GROUPING_VERSION = 1 ### Part of the grouping cache key. Increase it whenever a change of the grouping changes its results.
 
 def flatten_list(l):
     return list(itertools.chain.from_iterable(l))
@@ -188,6 +198,483 @@ def get_slices(nfield):
         rslcs = get_slices_from_list(jnslcflt)
     return rslcs
 
+def tokenize_group(group, values, widths, offsets):
+    """
+    Parses the numeric fields of a group of filenames in a single pass and appends them, one field after the
+    other, to the columns values, widths and offsets: the integer values, the number of digits and the start
+    offset of the field in each filename. As in get_numeric_fields, only the fields that exist in every filename
+    of the group are kept. Returns the number of fields.
+    """
+    spans = [[m.span() for m in numeric_pattern.finditer(item)] for item in group]
+    nfields = min([len(sp) for sp in spans]) if len(spans) > 0 else 0
+    for j in range(nfields):
+        column = [sp[j] for sp in spans]
+        values.extend([int(item[i0:i1]) for item, (i0, i1) in zip(group, column)])
+        widths.extend([i1 - i0 for i0, i1 in column])
+        offsets.extend([i0 for i0, _ in column])
+    return nfields
+
+def format_numfield(value, width):
+    """ Reconstructs the original digits of a numeric field, including any leading zeros. """
+    return str(value).zfill(width)
+
+def is_uniform(column):
+    return column[1:] == column[:-1]
+
+def get_run_bounds(values):
+    """ Returns the indices, at which the value of a column changes, framed by 0 and the column length. """
+    size = len(values)
+    changes = itertools.compress(range(1, size), map(operator.ne, values[1:], values[:-1]))
+    return [0] + list(changes) + [size]
+
+def get_identity_slices(values):
+    """ Column equivalent of get_identity_groups(slist, True). """
+    bounds = get_run_bounds(values)
+    return [slice(i0, i1, None) for i0, i1 in zip(bounds[:-1], bounds[1:])]
+
+def get_dynamic_incremental_counts(heads, widths):
+    """
+    Column equivalent of get_dynamic_incremental_groups.
+    Returns the number of items in each of the dynamic incremental groups instead of the groups themselves.
+    """
+    size = len(heads)
+    if size == 1:
+        return [1]
+    diffs = list(map(operator.sub, heads[1:], heads[:-1]))
+    if is_uniform(diffs):
+        return [size]
+    starts = [0]
+    increment = diffs[0]
+    next = False
+    for i, diff in enumerate(diffs, 1):
+        if diff == increment:
+            next = False
+        else:
+            starts.append(i)
+            if next:
+                increment = diff
+            next = True
+    grps = list(zip(starts, starts[1:] + [size]))
+    ### Correct the falsely separated unit groups that typically emerge from the process above
+    i = 1
+    while i < len(grps):
+        (a0, a1), (b0, b1) = grps[i - 1], grps[i]
+        if b1 - b0 > 1:
+            if heads[b0] - heads[a1 - 1] == heads[b0 + 1] - heads[b0]:
+                grps[i - 1:i + 1] = [(a0, b1)]
+                i = i - 1
+        i += 1
+    ### Regroup if two groups are identical
+    counts = [grps[0][1] - grps[0][0]]
+    for (a0, a1), (b0, b1) in zip(grps[:-1], grps[1:]):
+        if (heads[a0:a1] == heads[b0:b1]) and (widths[a0:a1] == widths[b0:b1]):
+            counts[-1] += b1 - b0
+        else:
+            counts.append(b1 - b0)
+    return counts
+
+def get_enumerated_period(heads, widths):
+    """
+    Returns the length of the period, in which the heads of a size group repeat, or None if they do not repeat
+    regularly. Within a period the values must be strictly increasing in their string order, so that the whole
+    size group can be described by the enumerated set of the values of one period.
+    """
+    strings = list(map(format_numfield, heads, widths))
+    period = len(strings)
+    for i in range(1, len(strings)):
+        if strings[i] <= strings[i - 1]:
+            period = i
+            break
+    if (period < 2) or (len(strings) % period != 0):
+        return None
+    if strings != strings[:period] * (len(strings) // period):
+        return None
+    return period
+
+def get_column_slices(values, widths, threshold = None):
+    """
+    Column equivalent of get_slices.
+    The values are compared as integers, while the widths keep apart fields such as '01' and '1'
+    wherever get_slices compares the original strings.
+    If threshold is given, a size group that the incremental grouping would fragment into threshold or more
+    slices is kept in one slice, provided that its values repeat periodically (see get_enumerated_period).
+    Such a field is later written as an enumerated set rather than a range.
+    """
+    size = len(values)
+    if is_uniform(values) and is_uniform(widths):
+        return [slice(0, size, None)]
+    bounds = get_run_bounds(values)
+    lengths = list(map(operator.sub, bounds[1:], bounds[:-1]))
+    slices = []
+    pos = 0
+    i = 0
+    while i < len(lengths):
+        ### Runs of identical values with the same length form a size group.
+        j = i
+        while (j < len(lengths)) and (lengths[j] == lengths[i]):
+            j += 1
+        heads = [values[bounds[k]] for k in range(i, j)]
+        hwidths = [widths[bounds[k]] for k in range(i, j)]
+        counts = get_dynamic_incremental_counts(heads, hwidths)
+        if (threshold is not None) and (len(counts) >= threshold) and (get_enumerated_period(heads, hwidths) is not None):
+            counts = [j - i]
+        for count in counts:
+            stop = pos + count * lengths[i]
+            slices.append(slice(pos, stop, None))
+            pos = stop
+        i = j
+    return slices
+
+def score_numfield(numfield, numfield_, widths, threshold = None):
+    """
+    Returns the slices, along which a numeric field divides its group.
+    numfield is None if the field is excluded from concatenation, in which case the group is split
+    wherever the original value changes.
+    """
+    if numfield is None:
+        return get_identity_slices(numfield_)
+    return get_column_slices(numfield, widths, threshold)
+
+def split_recursively(numfields, numfields_, widths, size, threshold = None, stats = None):
+    """
+    Divides a single group until none of its numeric fields splits it any further.
+    At each step the group is split along the numeric field with the fewest slices, which is
+    the same choice that the cycle/apply_index loop of the FilelistGrouper makes. The groups are
+    independent of each other, so each one is refined on its own rather than rescoring the
+    whole filelist after every split.
+    Returns the final partition as (start, stop) index ranges, in the order that the
+    iterative loop leaves them. If a stats dict is given, the number of scored ranges is added to stats['steps'].
+    """
+    ranges = []
+    stack = [(0, size)]
+    while len(stack) > 0:
+        start, stop = stack.pop()
+        if stats is not None:
+            stats['steps'] = stats.get('steps', 0) + 1
+        best = None
+        for nf, nf_, wd in zip(numfields, numfields_, widths):
+            if nf is not None:
+                nf = nf[start:stop]
+            slices = score_numfield(nf, nf_[start:stop], wd[start:stop], threshold)
+            if len(slices) > 1:
+                if (best is None) or (len(slices) < len(best)):
+                    best = slices
+        if best is None:
+            ranges.append((start, stop))
+        else:
+            ### apply_index inserts the slices in reverse order, so the last slice is expanded first.
+            for slc in best:
+                stack.append((start + slc.start, start + slc.stop))
+    return ranges
+
+def summarize_numfield(values, widths):
+    """
+    Returns the smallest and the largest value of a numeric field as strings, and the increment between
+    its two smallest unique values, which is None if the field has a single unique value.
+    The values are ordered as their strings sort, as was the case when the fields were kept as strings.
+    """
+    if is_uniform(widths):
+        uqs = sorted(set(values))
+        minvalstr = format_numfield(uqs[0], widths[0])
+        maxvalstr = format_numfield(uqs[-1], widths[0])
+        increment = uqs[1] - uqs[0] if len(uqs) > 1 else None
+    else:
+        uqs = sorted(set(map(format_numfield, values, widths)))
+        minvalstr, maxvalstr = uqs[0], uqs[-1]
+        increment = int(uqs[1]) - int(uqs[0]) if len(uqs) > 1 else None
+    return minvalstr, maxvalstr, increment
+
+def enumerate_numfield(values, widths):
+    """
+    Returns the unique values of a numeric field as strings in their string order, if they do not form a
+    regular range. Otherwise returns None.
+    """
+    uqs = sorted(set(map(format_numfield, values, widths)))
+    if len(uqs) < 3:
+        return None
+    diffs = list(map(operator.sub, map(int, uqs[1:]), map(int, uqs[:-1])))
+    if is_uniform(diffs):
+        return None
+    return uqs
+
+def split_group(args):
+    """ split_recursively for a single group, with picklable arguments so that groups can be split in worker processes. """
+    numfields, numfields_, widths, size, threshold = args
+    stats = {}
+    ranges = split_recursively(numfields, numfields_, widths, size, threshold, stats)
+    return ranges, stats['steps']
+
+def mask_numfields(numfields, axes):
+    """ Replaces the numeric fields that are excluded from concatenation ('x' in axes) with None. """
+    return [None if sign == 'x' else nf for nf, sign in zip(numfields, axes)]
+
+def column_view(column, start, stop):
+    """ A view of column[start:stop]. Only a list column (see FilenameTable) is copied. """
+    if isinstance(column, array):
+        return memoryview(column)[start:stop]
+    return column[start:stop]
+
+def get_group_ranges(table):
+    """
+    Index-range equivalent of group_preliminary for a FilenameTable.
+    Returns the (start, stop) ranges of the alpha groups.
+    """
+    ranges = []
+    lengths = table.lengths()
+    bounds = get_run_bounds(lengths)
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        ### As in group_by_alpha, the counts are taken in the order of appearance.
+        alphas = Counter()
+        for i in range(start, stop):
+            item = table[i]
+            alphas[item.translate(ascii_digits) if item.isascii() else get_alpha(item)] += 1
+        for count in alphas.values():
+            ranges.append((start, start + count))
+            start += count
+    return ranges
+
+def is_selected(name, selby = None, rejby = None):
+    return ((selby is None) or (selby in name)) and ((rejby is None) or (rejby not in name))
+
+def iter_filenames(rootDir, selby = None, rejby = None):
+    """ Yields the names of the directory entries in rootDir that pass the selby/rejby filters, as they are read. """
+    with os.scandir(rootDir) as entries:
+        for entry in entries:
+            name = entry.name
+            if is_selected(name, selby, rejby):
+                yield name
+
+def iter_csv_filenames(use_list, colname, selby = None, rejby = None):
+    """
+    Yields the filenames in the column colname of the csv file use_list that pass the selby/rejby filters.
+    use_list can also be a manifest (see manifest_db), from which only the column colname is read.
+    """
+    for name in read_column(use_list, colname):
+        # print(f'column: {name}')
+        if is_selected(name, selby, rejby):
+            yield name
+
+def _spill_run(names):
+    """ Writes a sorted run of names to an anonymous temporary file, one json string per line. """
+    run = tempfile.TemporaryFile('w+', encoding = 'utf-8')
+    for name in names:
+        run.write(json.dumps(name))
+        run.write('\n')
+    run.seek(0)
+    return run
+
+def _read_run(run):
+    with run:
+        for line in run:
+            yield json.loads(line)
+
+def sort_filenames(filenames, buffer_size = None):
+    """
+    Sorts an iterable of filenames holding at most buffer_size of them in memory.
+    Larger inputs are sorted in runs of buffer_size names, which are spilled to temporary files and
+    merged lazily. Returns an iterator over the sorted names.
+    """
+    if buffer_size is None:
+        buffer_size = SORT_BUFFER_SIZE
+    if buffer_size < 1:
+        raise ValueError("The sort buffer must hold at least one filename, not %s." % buffer_size)
+    filenames = iter(filenames)
+    runs = []
+    while True:
+        chunk = sorted(itertools.islice(filenames, buffer_size))
+        if len(chunk) < buffer_size:
+            break
+        runs.append(_spill_run(chunk))
+        del chunk
+    if len(runs) == 0:
+        return iter(chunk)
+    if len(chunk) > 0:
+        runs.append(_spill_run(chunk))
+    return heapq.merge(*[_read_run(run) for run in runs])
+
+def grouping_fingerprint(rootDir, concatenation_order = None, selby = None, rejby = None, use_list = None, colname = None,
+                         fragmentation_threshold = None):
+    """
+    A cheap fingerprint of the input of a FilelistGrouper: the names, sizes and modification times of the
+    entries in rootDir, together with the grouping options and GROUPING_VERSION. The entries are hashed one by one and the hashes
+    are summed, so the fingerprint does not depend on the listing order and the listing is never held in memory.
+    The tempdir and the pattern files, which are written into rootDir by the grouper itself, are left out.
+    """
+    total = 0
+    count = 0
+    with os.scandir(rootDir) as entries:
+        for entry in entries:
+            name = entry.name
+            if name == 'tempdir' or name.endswith('.pattern'):
+                continue
+            try:
+                st = entry.stat()
+            except OSError: ### broken symlink
+                st = entry.stat(follow_symlinks = False)
+            item = '%s\0%s\0%s' % (name, st.st_size, st.st_mtime_ns)
+            digest = hashlib.sha256(item.encode('utf-8', 'surrogateescape')).digest()
+            total = (total + int.from_bytes(digest, 'big')) % (1 << 256)
+            count += 1
+    h = hashlib.sha256()
+    h.update(total.to_bytes(32, 'big'))
+    if isinstance(concatenation_order, (list, tuple)):
+        concatenation_order = ','.join(concatenation_order)
+    options = [GROUPING_VERSION, count, concatenation_order, selby, rejby, colname, fragmentation_threshold]
+    if (use_list is not None) and (len(use_list) > 0):
+        digest = hashlib.sha256()
+        with open(use_list, 'rb') as reader:
+            for block in iter(lambda: reader.read(1 << 20), b''):
+                digest.update(block)
+        options.append(digest.hexdigest())
+    h.update(json.dumps(options).encode('utf-8'))
+    return h.hexdigest()
+
+def materialize_links(rootDir, newDir, links):
+    """
+    Creates the symlinks newDir/newitem -> rootDir/olditem for the (olditem, newitem) pairs in links.
+    The links are created relative to a single open descriptor of newDir, so the directory path is resolved
+    only once. Existing links with the same target are kept; links with a different target are replaced.
+    """
+    os.makedirs(newDir, exist_ok = True)
+    rootDir = os.path.abspath(rootDir)
+    dir_fd = os.open(newDir, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        for olditem, newitem in links:
+            oldpath_abs = os.path.abspath(os.path.join(rootDir, olditem))
+            try:
+                os.symlink(oldpath_abs, newitem, dir_fd = dir_fd)
+            except FileExistsError:
+                if os.readlink(newitem, dir_fd = dir_fd) != oldpath_abs:
+                    os.unlink(newitem, dir_fd = dir_fd)
+                    os.symlink(oldpath_abs, newitem, dir_fd = dir_fd)
+    finally:
+        os.close(dir_fd)
+
+def write_cache_entry(entry, rootDir):
+    """
+    Reproduces the output of FilelistGrouper.write from an entry created by FilelistGrouper.to_cache_entry:
+    recreates the symlinks in the tempdir, if any, and writes the pattern files.
+    """
+    if entry['tempdir']:
+        newDir = rootDir + '/tempdir'
+        materialize_links(rootDir, newDir, entry['links'])
+    else:
+        newDir = rootDir
+    if len(entry['patterns']) == 0:
+        raise ValueError("No pattern files were generated.")
+    for fname, reg in entry['patterns']:
+        with open(os.path.join(newDir, fname), 'w') as writer:
+            writer.write(reg)
+
+class FilenameTable:
+    """
+    The sorted filenames of a FilelistGrouper, stored once as a single string with an array of name bounds.
+    The table also keeps the numeric fields of the filenames (see tokenize_group) in three columns shared by
+    all alpha groups: the fields of each group are stored one after the other from the position in
+    field_bases. The groups of the FilelistGrouper are Group views of this table, so regrouping and pattern
+    generation never copy the filenames or their numeric fields.
+    """
+    __slots__ = ('_names', '_bounds', 'alpha_bounds', 'nfields', 'field_bases', 'values', 'widths', 'offsets')
+    def __init__(self, filelist, buffer_size = None):
+        """ filelist can be any iterable of names. It is consumed through sort_filenames, one name at a time. """
+        names = io.StringIO()
+        self._bounds = array('q', [0])
+        end = 0
+        for name in sort_filenames(filelist, buffer_size):
+            end += names.write(name)
+            self._bounds.append(end)
+        self._names = names.getvalue()
+        names.close()
+        ranges = get_group_ranges(self) if len(self) > 0 else []
+        self.alpha_bounds = array('q', [start for start, _ in ranges] + [len(self)])
+        self.nfields, self.field_bases = array('q'), array('q')
+        self.values, self.widths, self.offsets = array('q'), array('H'), array('H')
+        for start, stop in ranges:
+            self.field_bases.append(len(self.values))
+            self.nfields.append(self.__tokenize(self[start:stop]))
+    def __tokenize(self, group):
+        size = len(self.values)
+        try:
+            return tokenize_group(group, self.values, self.widths, self.offsets)
+        except OverflowError:
+            ### A value does not fit in 64 bits, so the values are kept in a list from now on.
+            for column in (self.values, self.widths, self.offsets):
+                del column[size:]
+            self.values = list(self.values)
+            return tokenize_group(group, self.values, self.widths, self.offsets)
+    def __len__(self):
+        return len(self._bounds) - 1
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        return self._names[self._bounds[idx]:self._bounds[idx + 1]]
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+    @property
+    def alpha_ranges(self):
+        return list(zip(self.alpha_bounds[:-1], self.alpha_bounds[1:]))
+    def lengths(self):
+        return array('q', map(operator.sub, self._bounds[1:], self._bounds[:-1]))
+    def field_range(self, alpha_no, nf_no, start, stop):
+        """ The positions in the columns of the field nf_no of the filenames start to stop of the alpha group alpha_no. """
+        first, last = self.alpha_bounds[alpha_no], self.alpha_bounds[alpha_no + 1]
+        base = self.field_bases[alpha_no] + nf_no * (last - first) - first
+        return base + start, base + stop
+
+class Group(Sequence):
+    """ A view of the filenames table[start:stop], which belong to the alpha group alpha_no of the table. """
+    __slots__ = ('table', 'alpha_no', 'start', 'stop')
+    def __init__(self, table, alpha_no, start, stop):
+        self.table = table
+        self.alpha_no = alpha_no
+        self.start = start
+        self.stop = stop
+    def __len__(self):
+        return self.stop - self.start
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(len(self))
+            assert step == 1, "Groups can only be sliced contiguously."
+            return Group(self.table, self.alpha_no, self.start + start, self.start + max(start, stop))
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("group index out of range")
+        return self.table[self.start + idx]
+    def __iter__(self):
+        for i in range(self.start, self.stop):
+            yield self.table[i]
+    def __repr__(self):
+        return 'Group(%s)' % list(self)
+    @property
+    def key(self):
+        """ Identifies the group by its index range, which does not change when other groups are split. """
+        return (self.alpha_no, self.start, self.stop)
+    @property
+    def nfields(self):
+        return self.table.nfields[self.alpha_no]
+    def __view(self, column, nf_no):
+        return column_view(column, *self.table.field_range(self.alpha_no, nf_no, self.start, self.stop))
+    def numfield(self, nf_no):
+        return self.__view(self.table.values, nf_no)
+    def width(self, nf_no):
+        return self.__view(self.table.widths, nf_no)
+    def offset(self, nf_no):
+        return self.__view(self.table.offsets, nf_no)
+    def numfields(self):
+        return [self.numfield(j) for j in range(self.nfields)]
+    def widths(self):
+        return [self.width(j) for j in range(self.nfields)]
+    def columns(self):
+        """ Copies of the numeric fields and widths of the group, which unlike the views can be pickled. """
+        ranges = [self.table.field_range(self.alpha_no, j, self.start, self.stop) for j in range(self.nfields)]
+        numfields = [self.table.values[i0:i1] for i0, i1 in ranges]
+        widths = [self.table.widths[i0:i1] for i0, i1 in ranges]
+        return numfields, widths
+
 def __get_numfield_intervals(grp):
     file = grp[-1]
     numfields, numfield_intervals = [], []
@@ -271,69 +758,95 @@ def parse_axes(axes, nfields):
     # print(f"final: {final} and is_auto: {is_auto}")
     return final, is_auto
 
+class SliceCache:
+    """
+    Caches the slices of each numeric field of a group, keyed by the index range of the group.
+    A group keeps its key until it is split itself, so a grouping iteration only scores the groups
+    that the previous split created. hits and misses count the per-group lookups.
+    """
+    def __init__(self, threshold = None):
+        self.threshold = threshold
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+    def __len__(self):
+        return len(self.entries)
+    def get(self, grp, axes):
+        """ Returns the slices of all numeric fields of grp. Fields that do not split the group have a single slice. """
+        key = grp.key
+        if key in self.entries:
+            self.hits += 1
+            return self.entries[key]
+        self.misses += 1
+        slices = []
+        for nf_no in range(grp.nfields):
+            numfield = grp.numfield(nf_no)
+            if axes[nf_no] == 'x':
+                slices.append(score_numfield(None, numfield, None))
+            else:
+                slices.append(score_numfield(numfield, numfield, grp.width(nf_no), self.threshold))
+        self.entries[key] = slices
+        return slices
+    def invalidate(self, grp):
+        self.entries.pop(grp.key, None)
+    def clear(self):
+        self.entries = {}
+
 class FilelistGrouper:
-    def __init__(self, rootDir, concatenation_order = None, selby = None, rejby = None, use_list = None, colname = None):
+    def __init__(self, rootDir, concatenation_order = None, selby = None, rejby = None, use_list = None, colname = None, sort_buffer = None,
+                 fragmentation_threshold = None):
+        """
+        fragmentation_threshold: if given, a numeric field that would split a group into this many or more pieces
+        is written as an enumerated set such as <1,3,7,12> instead, as long as its values repeat regularly.
+        """
+        self.stats = {'phases': {}}
+        t0 = time.perf_counter()
+        self.rootDir = rootDir
+        self.fragmentation_threshold = fragmentation_threshold
+        self.selby = selby
+        self.rejby = rejby
+        self.sort_buffer = sort_buffer
         if (use_list is None) or (len(use_list) == 0):
             self.is_csv = False
-            filelist = os.listdir(rootDir)
+            filelist = iter_filenames(rootDir, selby, rejby)
         else:
             self.is_csv = True
             assert colname is not None
-            filelist = []
-            with open(use_list, 'r') as csv_file:
-                csv_reader = csv.DictReader(csv_file)
-                for row in csv_reader:
-                    # print(f'column: {row[colname]}')
-                    filelist.append(row[colname])
-        self.rootDir = rootDir
-        fl = copy.deepcopy(filelist)
-        self.selby = selby
-        self.rejby = rejby
-        if selby is not None:
-            fl = [item for item in fl if selby in item]
-        if rejby is not None:
-            fl = [item for item in fl if not rejby in item]
-        self.fl = sorted(fl)
+            filelist = iter_csv_filenames(use_list, colname, selby, rejby)
+        self.fl = FilenameTable(filelist, sort_buffer)
+        self.stats['files'] = len(self.fl)
+        self.stats['phases']['listing'] = time.perf_counter() - t0
         # print(self.fl)
         self.fname_is_repaired = False
         self.__group_by_alpha()
-        self.__get_numeric_fields()
         self.__reindex_numeric_fields(concatenation_order)
         self.scoreboard = {}
+        self.slice_cache = SliceCache(fragmentation_threshold)
         self.patterns = {}
         self.nf_intervals = {}
         self.regex_filenames, self.regexes = {}, {}
+        self.links = {}
+        t0 = time.perf_counter()
         self.__setup_filenames()
+        self.stats['phases']['renaming'] = time.perf_counter() - t0
+        self.stats['renamed_files'] = len(self.links)
     def __group_by_alpha(self):
-        filelist = copy.deepcopy(self.fl)
-        # print(f'group_alpha: {filelist}')
-        self.alphagrps = group_preliminary(filelist)
-        self.grps = copy.deepcopy(self.alphagrps)
-    def __get_numeric_fields(self):
-        self.numfields_global = []
-        for alphagrp in self.alphagrps:
-            numfields = get_numeric_fields(alphagrp)
-            self.numfields_global.append(numfields)
-        self.numfields_original = copy.deepcopy(self.numfields_global)
-        # print(self.numfields_original)
+        ### The table is already divided into alpha groups. The groups are views of its index ranges.
+        self.alphagrps = [Group(self.fl, i, start, stop) for i, (start, stop) in enumerate(self.fl.alpha_ranges)]
+        self.grps = list(self.alphagrps)
+    @property
+    def numfields_original(self):
+        return [grp.numfields() for grp in self.grps]
+    @property
+    def numfields_global(self):
+        return [mask_numfields(grp.numfields(), axes) for grp, axes in zip(self.grps, self.concatenation_order)]
     def __reindex_numeric_fields(self, axes):
         if axes is None:
             axes = 'auto'
         axes, self.is_auto = parse_axes(axes, self.numfields_original)
         if self.fname_is_repaired:
             self.is_auto = False
-        replacement = []
-        for i, axpattern in enumerate(axes):
-            nfield_repl = []
-            nfields = copy.deepcopy(self.numfields_global[i])
-            if len(nfields) == len(axpattern):
-                for j, sign in enumerate(axpattern):
-                    if sign == 'x':
-                        nfield_repl.append([None] * len(nfields[j]))
-                    else:
-                        nfield_repl.append(nfields[j])
-            replacement.append(nfield_repl)
-        self.numfields_global = replacement
+        ### The fields marked with 'x' are masked by numfields_global.
         self.concatenation_order = axes
         if self.is_auto and not self.is_csv:
             self.newDir = self.rootDir
@@ -361,53 +874,38 @@ class FilelistGrouper:
     def __setup_filenames(self):
         newgrps = self.__proofread_filenames()
         is_auto = self.is_auto
-        oldDir = self.rootDir
-        newDir = self.newDir
         axes = self.concatenation_order
-        if not is_auto or self.is_csv:  ### The default scenario where user chooses the automatic detection of axes.
-            try:
-                os.makedirs(newDir)
-            except:
-                pass
-            for i, grp in enumerate(self.grps):
-                newgrp = newgrps[i]
-                # print(f'newgrp: {newgrp}')
-                newnames = _insert_dimension_specifiers(newgrp, axes[i])
-                # print(f'newnames: {newnames}')
-                for olditem, newitem in zip(grp, newnames):
-                    oldpath = os.path.join(oldDir, olditem)
-                    newpath = os.path.join(newDir, newitem)
-                    oldpath_abs = os.path.abspath(oldpath)
-                    # print(oldpath)
-                    # print(newpath)
-                    os.symlink(oldpath_abs, newpath)
-        # print(f'newdir: {newDir}')
-        filelist = os.listdir(newDir)
-        # assert all([item in filelist for item in self.fl]), f'The filenames in the newDir do not match the original filenames. Wrong csv file?'
-        fl = copy.deepcopy(filelist)
-        if self.selby is not None:
-            fl = [item for item in fl if self.selby in item]
-        if self.rejby is not None:
-            fl = [item for item in fl if not self.rejby in item]
-        self.fl = sorted(fl)
+        if is_auto and not self.is_csv:  ### The default scenario where user chooses the automatic detection of axes.
+            return ### The files are grouped in place under their original names.
+        ### The renamed files form a virtual tempdir: self.links maps each new name to the original one.
+        ### The symlinks are only created by write, for the files that end up in the pattern files.
+        for i, grp in enumerate(self.grps):
+            newgrp = newgrps[i]
+            # print(f'newgrp: {newgrp}')
+            newnames = _insert_dimension_specifiers(newgrp, axes[i])
+            # print(f'newnames: {newnames}')
+            for olditem, newitem in zip(grp, newnames):
+                if newitem in self.links:
+                    raise ValueError("The files %s and %s are both renamed to %s." % (self.links[newitem], olditem, newitem))
+                self.links[newitem] = olditem
+        # print(f'newdir: {self.newDir}')
+        filelist = (item for item in self.links if is_selected(item, self.selby, self.rejby))
+        self.fl = FilenameTable(filelist, self.sort_buffer)
+        self.slice_cache.clear()
         self.__group_by_alpha()
-        self.__get_numeric_fields()
         self.__reindex_numeric_fields(self.concatenation_order)
     def regroup(self, grp_no, nf_no):
-        numfield = self.numfields_global[grp_no][nf_no]
-        numfield_ = self.numfields_original[grp_no][nf_no]
-        if numfield[0] is None:
-            slices = get_identity_groups(numfield_, True)
-        else:
-            slices = get_slices(numfield)
+        slices = self.slice_cache.get(self.grps[grp_no], self.concatenation_order[grp_no])[nf_no]
         score = len(slices)
         if score > 1:
             self.scoreboard[(grp_no, nf_no)] = (score, slices)
     def cycle(self):
-        for i, nfgrp in enumerate(self.numfields_global):
-            nfgrp = self.numfields_global[i]
-            for j in range(len(nfgrp)):
-                self.regroup(i, j)
+        ### Only the groups created by the last apply_index miss the slice cache.
+        for i, grp in enumerate(self.grps):
+            slices = self.slice_cache.get(grp, self.concatenation_order[i])
+            for j, slcs in enumerate(slices):
+                if len(slcs) > 1:
+                    self.scoreboard[(i, j)] = (len(slcs), slcs)
     def apply_index(self): # TO BE APPLIED FOR A SINGLE ALPHAGRP
         if len(self.scoreboard) == 0:
             print("Iterations must end. No new indices found.")
@@ -420,104 +918,139 @@ class FilelistGrouper:
             idx_best = scores.index(score_best)
             grp_no, numf_no = ids[idx_best]
             slcs = slices[idx_best]
-            grp = self.grps[grp_no]
-            numfields = self.numfields_global[grp_no]
-            numfields_ = self.numfields_original[grp_no]
-            sliced_numfields, sliced_numfields_, sliced_grp = [], [], []
+            grp = self.grps.pop(grp_no)
+            axes = self.concatenation_order.pop(grp_no)
+            self.slice_cache.invalidate(grp)
             for slc in slcs:
-                sliced_grp.append(grp[slc])
-                sliced_nf_pergr = [nf[slc] for nf in numfields]
-                sliced_nf_pergr_ = [nf[slc] for nf in numfields_]
-                sliced_numfields.append(sliced_nf_pergr)
-                sliced_numfields_.append(sliced_nf_pergr_)
-            self.grps.pop(grp_no)
-            self.numfields_global.pop(grp_no)
-            self.numfields_original.pop(grp_no)
-            axes_grp = self.concatenation_order
-            axes = axes_grp[grp_no]
-            self.concatenation_order.insert(grp_no, axes)
-            for grp, nf, nf_ in zip(sliced_grp, sliced_numfields, sliced_numfields_):
                 # print(len(self.scoreboard))
-                if len(grp) > 0:
-                    self.grps.insert(grp_no, grp)
-                if len(nf) > 0:
-                    elnum = get_elnum(nf)
-                    if elnum > 0:
-                        # print(elnum)
-                        self.numfields_global.insert(grp_no, nf)
-                        self.numfields_original.insert(grp_no, nf_)
+                self.grps.insert(grp_no, grp[slc])
+                self.concatenation_order.insert(grp_no, axes)
             self.scoreboard = {}
-    def group_files(self):
+    def group_files(self, method = 'recursive', workers = None):
+        """
+        Divides the alpha groups into the final file groups.
+        method = 'recursive' splits each group independently and reaches the final partition in a single pass.
+        method = 'iterative' runs the original cycle/apply_index loop, which rescores all groups after every split.
+        Both methods produce the same groups in the same order.
+        workers > 1 splits the groups in a pool of that many processes (recursive method only).
+        """
+        if method == 'recursive':
+            return self.__group_files_recursive(workers)
+        elif method != 'iterative':
+            raise ValueError("The grouping method must be either 'recursive' or 'iterative', not %s." % method)
+        elif (workers is not None) and (workers > 1):
+            raise ValueError("Parallel grouping is only available with the recursive method.")
+        self.stats.update({'method': method, 'groups_in': len(self.grps), 'iterations': 0, 'max_scoreboard': 0})
         for i in range(2):
             if i > 0: split_by_increments = True
             oldres = None
             while True:
                 # print(split_by_increments)
                 self.cycle()
+                self.stats['iterations'] += 1
+                self.stats['max_scoreboard'] = max(self.stats['max_scoreboard'], len(self.scoreboard))
                 self.apply_index()
                 res = len(self.grps)
                 if res == oldres:
                     break
                 oldres = res
+        self.stats['groups_out'] = len(self.grps)
+        self.stats['slice_cache'] = {'entries': len(self.slice_cache), 'hits': self.slice_cache.hits, 'misses': self.slice_cache.misses}
+        return self.grps
+    def __group_files_recursive(self, workers = None):
+        self.stats.update({'method': 'recursive', 'groups_in': len(self.grps), 'workers': workers or 1})
+        grps, concatenation_order = [], []
+        if (workers is not None) and (workers > 1) and (len(self.grps) > 1):
+            ### The groups are independent, so they are split in worker processes. map returns the results in the order of the groups.
+            def jobs():
+                for grp, axes in zip(self.grps, self.concatenation_order):
+                    numfields_, widths = grp.columns()
+                    yield mask_numfields(numfields_, axes), numfields_, widths, len(grp), self.fragmentation_threshold
+            chunksize = max(1, len(self.grps) // (workers * 4))
+            with ProcessPoolExecutor(max_workers = workers) as executor:
+                partitions, steps = [], 0
+                for ranges, nsteps in executor.map(split_group, jobs(), chunksize = chunksize):
+                    partitions.append(ranges)
+                    steps += nsteps
+        else:
+            partitions = []
+            stats = {'steps': 0}
+            for grp, axes in zip(self.grps, self.concatenation_order):
+                numfields_ = grp.numfields()
+                numfields = mask_numfields(numfields_, axes)
+                partitions.append(split_recursively(numfields, numfields_, grp.widths(), len(grp), self.fragmentation_threshold, stats))
+            steps = stats['steps']
+        self.stats['steps'] = steps
+        for grp, axes, ranges in zip(self.grps, self.concatenation_order, partitions):
+            for start, stop in ranges:
+                grps.append(grp[start:stop])
+                concatenation_order.append(axes)
+        self.grps = grps
+        self.concatenation_order = concatenation_order
+        self.scoreboard = {}
+        self.stats['groups_out'] = len(self.grps)
         return self.grps
     ####################### Above methods divide filelist into groups. Below we create pattern files for each group using respective numeric field.
     def __get_numfield_intervals(self, grp_no):
+        ### The intervals of the numeric fields in the last filename of the group, taken from the tokenized columns.
         grp = self.grps[grp_no]
-        file = grp[-1]
         numfields, numfield_intervals = [], []
-        for m in re.finditer(r'\d+', file):
-            zoneidx = (m.start(0), m.end(0))
-            zone = file[zoneidx[0]:zoneidx[1]]
-            numfield_intervals.append(zoneidx)
-            numfields.append(zone)
+        for j in range(grp.nfields):
+            offset, width = grp.offset(j)[-1], grp.width(j)[-1]
+            numfield_intervals.append((offset, offset + width))
+            numfields.append(format_numfield(grp.numfield(j)[-1], width))
         return numfields, numfield_intervals
+    def __enumerate_numfield(self, grp_no, nf_no):
+        if self.fragmentation_threshold is None:
+            return None
+        grp = self.grps[grp_no]
+        return enumerate_numfield(grp.numfield(nf_no), grp.width(nf_no))
     def __create_pattern_perNumfield(self, grp_no, nf_no):
-        nf = sorted(copy.deepcopy(self.numfields_global[grp_no][nf_no]))
+        if self.concatenation_order[grp_no][nf_no] == 'x':
+            return None
+        nf = self.grps[grp_no].numfield(nf_no)
         # nf = ['00', '02', '04', '06', '00', '02', '04', '06']
         # nf = ['1349', '1349', '1349', '1349', '1349']
-        # nf.sort()
-        uqs, _ = find_uniques(nf)
-        minvalstr = nf[0]; maxvalstr =nf[-1]
-        if nf[0] is None:
-            pattern = None
+        minvalstr, maxvalstr, increment = summarize_numfield(nf, self.grps[grp_no].width(nf_no))
+        uqs = self.__enumerate_numfield(grp_no, nf_no)
+        if uqs is not None: ### Bio-Formats does not allow ranges and lists to be mixed within a single block.
+            pattern = '<%s>' % ','.join(uqs)
         elif len(nf) == 1:
             pattern = '<%s>' % maxvalstr
-        elif len(uqs) > 1:
-            increment = int(uqs[1]) - int(uqs[0])
+        elif increment is not None:
             if increment > 0:
                 pattern = '<%s-%s:%s>' % (minvalstr, maxvalstr, increment)
             elif increment == 0: ### THIS IS AN IMPOSSIBLE OPTION
                 pattern = '<%s>' % maxvalstr
             elif increment < 0:
                 print("Something is seriously wrong. Increment within a group cannot be below zero.")
-        elif len(uqs) == 1:
+        else:
             pattern = '<%s>' % maxvalstr
         return pattern
     def __create_patternfilename_perNumfield(self, grp_no, nf_no):
-        nf = sorted(copy.deepcopy(self.numfields_global[grp_no][nf_no]))
+        if self.concatenation_order[grp_no][nf_no] == 'x':
+            return None
+        nf = self.grps[grp_no].numfield(nf_no)
         # nf = ['00', '02', '04', '06', '00', '02', '04', '06']
         # nf = ['1349', '1349', '1349', '1349', '1349']
-        # nf.sort()
-        uqs, _ = find_uniques(nf)
-        minvalstr = nf[0]; maxvalstr =nf[-1]
-        if nf[0] is None:
-            pattern = None
+        minvalstr, maxvalstr, increment = summarize_numfield(nf, self.grps[grp_no].width(nf_no))
+        uqs = self.__enumerate_numfield(grp_no, nf_no)
+        if uqs is not None:
+            pattern = 'Set{%s}' % '-'.join(uqs)
         elif len(nf) == 1:
             pattern = '%s' % maxvalstr
-        elif len(uqs) > 1:
-            increment = int(uqs[1]) - int(uqs[0])
+        elif increment is not None:
             if increment > 0:
                 pattern = 'Range{%s-%s-%s}' % (minvalstr, maxvalstr, increment)
             elif increment == 0: ### THIS IS AN IMPOSSIBLE OPTION
                 pattern = '%s' % maxvalstr
             elif increment < 0:
                 print("Something is seriously wrong. Increment within a group cannot be below zero.")
-        elif len(uqs) == 1:
+        else:
             pattern = '%s' % maxvalstr
         return pattern
     def find_patterns(self):
         grps = self.grps
-        numfields_global = self.numfields_global
         fnames = {}
         filenames = {}
         regexes = {}
@@ -525,10 +1058,10 @@ class FilelistGrouper:
             self.patterns[grp_no] = []
             fnames[grp_no] = []
             _, intervals = self.__get_numfield_intervals(grp_no)
-            nfields = numfields_global[grp_no]
             self.nf_intervals[grp_no] = intervals
-            for i, nfield in enumerate(nfields):
-                if nfield[0] is None:
+            ### The signs of the axes tell the masked fields of numfields_global without creating views of the fields.
+            for i, sign in enumerate(self.concatenation_order[grp_no][:grps[grp_no].nfields]):
+                if sign == 'x':
                     pattern = None
                     fname = None
                 else:
@@ -542,7 +1075,7 @@ class FilelistGrouper:
             grp = grps[grp_no]
             intervals = self.nf_intervals[grp_no]
             # print(f"intervals: {intervals}")
-            reg = copy.deepcopy(grp[-1])
+            reg = grp[-1]
             pgrp = patterns[grp_no]
             reconst = [reg[:intervals[0][0]]]
 
@@ -570,6 +1103,7 @@ class FilelistGrouper:
             inds_ht = [i for i in range(len(tlist)) if tlist[i] == '>']
             inds_dash = [i for i in range(len(tlist)) if tlist[i] == '-']
             inds_dots = [i for i in range(len(tlist)) if tlist[i] == ':']
+            inds_comma = [i for i in range(len(tlist)) if tlist[i] == ',']
             for idx in range(len(tlist)):
                 if idx in inds_lt:
                     tlist.pop(idx)
@@ -585,15 +1119,42 @@ class FilelistGrouper:
                         if (idx > i) and (idx < j):
                             tlist.pop(idx)
                             tlist.insert(idx, 'to')
+                if idx in inds_comma:
+                    for i, j in zip(inds_lt, inds_ht):
+                        if (idx > i) and (idx < j):
+                            tlist.pop(idx)
+                            tlist.insert(idx, '_')
             string = ''.join(tlist)
             string = os.path.splitext(string)[0] + '.pattern'
             filenames[grp_no] = string
         self.regexes = transpose_list(regexes.items())[1]
         self.regex_filenames = transpose_list(filenames.items())[1]
+    def plan(self):
+        """ The pattern files that write would create, with the pattern and the number of files of each. """
+        return [{'path': os.path.join(self.newDir, fname), 'pattern': reg, 'files': len(grp)}
+                for fname, reg, grp in zip(self.regex_filenames, self.regexes, self.grps)]
+    def grouped_links(self):
+        """ The (original name, new name) pairs of the files in the groups, which are linked into the tempdir. """
+        if self.newDir == self.rootDir:
+            return []
+        return [(self.links[newitem], newitem) for grp in self.grps for newitem in grp]
+    def to_cache_entry(self):
+        """ The groups, the tempdir symlinks and the pattern files of the grouper, to be restored with write_cache_entry. """
+        return {'tempdir': self.newDir != self.rootDir,
+                'links': self.grouped_links(),
+                'groups': [list(grp) for grp in self.grps],
+                'patterns': list(zip(self.regex_filenames, self.regexes))
+                }
     def write(self):
         newDir = self.newDir
         if len(self.regexes) == 0:
             raise ValueError("No pattern files were generated.")
+        if newDir != self.rootDir:
+            t0 = time.perf_counter()
+            links = self.grouped_links()
+            materialize_links(self.rootDir, newDir, links)
+            self.stats['links'] = len(links)
+            self.stats['phases']['linking'] = time.perf_counter() - t0
         for fname, reg in zip(self.regex_filenames, self.regexes):
             fpath = os.path.join(newDir, fname)
             # print(f"fpath: {fpath}")
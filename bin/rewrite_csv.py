@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+Streaming rewriter for the csv manifests of the independent conversion.
+
+The rows are read, rewritten and written one at a time, so a manifest is never held in memory and the
+rows are not copied. The stages are generators and can be chained with those of parse_csv to rewrite a
+manifest in a single pass, e.g.:
+
+    rows = parse_rows(read_rows(source), ref_dir, root_column, input_column)
+    rows = rewrite_rows(rows, 'RootOriginal', 'ImageNameOriginal', out_path, 'ome.zarr')
+    write_csv(rows, 'FileList.csv')
+"""
+
+import csv, os, sys, argparse
+
+from manifest_db import read_rows
+
+CONVERTED_FIELDS = ["RootOriginal", "ImageNameOriginal", "RootConverted", "ImageNameConverted"]
+
+def get_extension(conversion_type):
+    conversion_type = conversion_type.lower()
+    if conversion_type == 'ometiff':
+        return 'ome.tiff'
+    elif conversion_type == 'omezarr':
+        return 'ome.zarr'
+    raise ValueError(f"Unknown conversion type: {conversion_type}")
+
+def rewrite_rows(rows, dircol, namecol, destpath, outext, keep_columns = True):
+    """
+    Adds RootConverted and ImageNameConverted to each row. The converted name is the part of the filename
+    before its first dot, followed by outext.
+    If keep_columns is False, each row is replaced by RootOriginal, ImageNameOriginal and the converted columns,
+    where RootOriginal is the root column joined with the directory part of the relative path.
+    """
+    for row in rows:
+        relpath = row[namecol]
+        filename = os.path.basename(relpath)
+        new_filename = filename.split('.')[0] + f".{outext}"
+        if keep_columns:
+            ### DictReader creates a new dict for every row, so it is safe to update it in place.
+            row.update({f"RootConverted": destpath, f"ImageNameConverted": new_filename})
+            yield row
+        else:
+            newroot = os.path.join(row[dircol], os.path.dirname(relpath))
+            if newroot.endswith('/'):
+                newroot = newroot[:-1]
+            yield {f"RootOriginal": newroot, f"ImageNameOriginal": filename, f"RootConverted": destpath, f"ImageNameConverted": new_filename}
+
+def write_csv(rows, csvname, fieldnames = None):
+    """ Writes rows as they arrive. Without fieldnames, the header is taken from the first row. Returns the number of rows. """
+    count = 0
+    with open(csvname, 'w', newline='') as csv_file:
+        csv_writer = None
+        if fieldnames is not None:
+            csv_writer = csv.DictWriter(csv_file, fieldnames = fieldnames)
+            csv_writer.writeheader()
+        for row in rows:
+            if csv_writer is None:
+                csv_writer = csv.DictWriter(csv_file, fieldnames = list(row.keys()))
+                csv_writer.writeheader()
+            csv_writer.writerow(row)
+            count += 1
+    return count
+
+def rewrite_csv(csv_file_path, csvname, dircol, namecol, destpath, conversion_type = 'ometiff', keep_columns = True):
+    """ Rewrites the manifest csv_file_path into csvname in a single pass. Returns the number of rows. """
+    outext = get_extension(conversion_type)
+    os.makedirs(os.path.dirname(f'./{destpath}'), exist_ok = True)
+    rows = rewrite_rows(read_rows(csv_file_path), dircol, namecol, destpath, outext, keep_columns)
+    return write_csv(rows, csvname, fieldnames = None if keep_columns else CONVERTED_FIELDS)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('csv_file_path')
+    parser.add_argument('root_column')
+    parser.add_argument('relpath_column')
+    parser.add_argument('csv_dest_path')
+    parser.add_argument('csv_file_name')
+    parser.add_argument('--conversion_type', choices = ['ometiff', 'omezarr', 'OMETIFF', 'OMEZARR'], default = 'ometiff')
+    parser.add_argument('--original_columns_only', default = False, action = 'store_true',
+                        help = 'Write only the original and converted path columns instead of keeping all columns.')
+    args = parser.parse_args()
+    rewrite_csv(args.csv_file_path, args.csv_file_name, args.root_column, args.relpath_column, args.csv_dest_path,
+                args.conversion_type, keep_columns = not args.original_columns_only)
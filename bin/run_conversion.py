@@ -6,9 +6,541 @@ import json
 import os
 import sys
 import re
+import csv
+import time
+import shutil
+import socket
+import threading
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from conversion_cache import ConversionCache
+from cache_store import get_size
+from scratch_stage import Stager, get_pattern_files
 
 intlist = lambda s: [int(x) for x in re.findall(r'\b\d+\b', s)]
 
+def intorauto(s):
+    if s == 'auto':
+        return s
+    return int(s)
+
+LOG_TAIL = 4000 ### The number of characters of the output of a failed conversion kept in the batch report.
+
+### Constants of the auto mode.
+BASE_HEAP = 1 << 30 ### JVM heap that a conversion needs regardless of its number of workers.
+WORKER_HEAP = 256 << 20 ### Additional heap per bioformats2raw worker, enough for a few chunks in flight.
+LARGE_INPUT = 1 << 30 ### Inputs larger than this get at least MIN_LARGE_WORKERS workers each.
+MIN_LARGE_WORKERS = 4
+MEMORY_FRACTION = 0.8 ### Fraction of the memory limit given to the JVMs; the rest is left to the page cache and to python.
+
+def read_cgroup_value(path):
+    try:
+        with open(path, 'r') as reader:
+            return reader.read().split()
+    except OSError:
+        return None
+
+def get_cpu_limit():
+    """
+    Number of CPUs allocated to this task, or None if no allocation is found: SLURM_CPUS_PER_TASK, an affinity mask
+    narrower than the node or a cgroup CPU quota, whichever is smallest.
+    """
+    limits = []
+    if os.environ.get('SLURM_CPUS_PER_TASK', '').isdigit():
+        limits.append(int(os.environ['SLURM_CPUS_PER_TASK']))
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = len(os.sched_getaffinity(0))
+        if cpus < (os.cpu_count() or cpus):
+            limits.append(cpus)
+    quota = read_cgroup_value('/sys/fs/cgroup/cpu.max') ### cgroup v2
+    if quota is not None and quota[0] != 'max':
+        limits.append(max(1, int(int(quota[0]) / int(quota[1]))))
+    else:
+        quota = read_cgroup_value('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') ### cgroup v1
+        period = read_cgroup_value('/sys/fs/cgroup/cpu/cpu.cfs_period_us')
+        if quota is not None and period is not None and int(quota[0]) > 0:
+            limits.append(max(1, int(int(quota[0]) / int(period[0]))))
+    return min(limits) if len(limits) > 0 else None
+
+def get_memory_limit(cpus = None):
+    """
+    Memory allocated to this task in bytes, or None if no allocation is found: SLURM_MEM_PER_NODE, SLURM_MEM_PER_CPU
+    times the CPUs of the task, or a cgroup memory limit below the physical memory, whichever is smallest.
+    """
+    physical = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    limits = []
+    if os.environ.get('SLURM_MEM_PER_NODE', '').isdigit(): ### in megabytes
+        limits.append(int(os.environ['SLURM_MEM_PER_NODE']) << 20)
+    if os.environ.get('SLURM_MEM_PER_CPU', '').isdigit():
+        limits.append((int(os.environ['SLURM_MEM_PER_CPU']) << 20) * (cpus or 1))
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        value = read_cgroup_value(path)
+        if value is not None and value[0] != 'max' and int(value[0]) < physical: ### cgroup v1 reports a huge value without a limit
+            limits.append(int(value[0]))
+            break
+    return min(limits) if len(limits) > 0 else None
+
+def get_allocation(cpus = None, memory = None):
+    """
+    The CPUs and memory of this task. Values that are not given are read from SLURM and the cgroup limits. Without a
+    memory limit, the task gets the share of the physical memory that its CPUs are of the node. Raises a ValueError if
+    the CPUs of the task are unknown, since taking the whole node in every task would oversubscribe it.
+    """
+    cpus = get_cpu_limit() if cpus is None else cpus
+    if cpus is None:
+        raise ValueError("The auto mode needs the CPUs allocated to the task. Pass --cpus, or run within a SLURM allocation or a cgroup CPU limit.")
+    memory = get_memory_limit(cpus) if memory is None else memory
+    if memory is None:
+        physical = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+        memory = physical * min(cpus, os.cpu_count() or cpus) // (os.cpu_count() or cpus)
+    return cpus, memory
+
+def get_input_size(inps):
+    """ Size of an input in bytes. For a pattern file, the sizes of the files it expands to are summed. """
+    if not os.path.isfile(inps):
+        return 0
+    if not inps.endswith('.pattern'):
+        return os.path.getsize(inps)
+    return sum(os.path.getsize(path) for path in get_pattern_files(inps))
+
+def auto_tune(sizes, cpus = None, memory = None):
+    """
+    Picks the number of concurrent conversions, the bioformats2raw workers of each conversion and the JVM heap
+    of each conversion for inputs of the given sizes. Small inputs are converted side by side with few workers each,
+    large inputs one or a few at a time with more workers. The concurrency is bounded so that every conversion
+    gets BASE_HEAP plus WORKER_HEAP per worker within MEMORY_FRACTION of the memory limit. cpus and memory are those
+    of the task (see get_allocation).
+    """
+    cpus, memory = get_allocation(cpus, memory)
+    usable = int(memory * MEMORY_FRACTION)
+    largest = max(sizes) if len(sizes) > 0 else 0
+    concurrency = max(1, min(len(sizes), cpus, usable // (BASE_HEAP + WORKER_HEAP)))
+    if largest > LARGE_INPUT:
+        concurrency = max(1, min(concurrency, cpus // MIN_LARGE_WORKERS))
+    max_workers = max(1, cpus // concurrency)
+    heap = max(BASE_HEAP, usable // concurrency)
+    max_workers = max(1, min(max_workers, (heap - BASE_HEAP) // WORKER_HEAP))
+    return {'cpus': cpus, 'memory': memory, 'largest_input': largest, 'items': len(sizes),
+            'concurrency': concurrency, 'max_workers': max_workers, 'heap': heap}
+
+def apply_tuning(args, tuning):
+    """ Returns a copy of args with the tuned max_workers, and the environment, in which the converters get the tuned JVM heap. """
+    args = argparse.Namespace(**vars(args))
+    args.max_workers = tuning['max_workers']
+    heap = '%sm' % (tuning['heap'] >> 20)
+    env = dict(os.environ)
+    env['JAVA_OPTS'] = ' '.join([item for item in (env.get('JAVA_OPTS', ''), '-Xmx%s' % heap) if item != ''])
+    env['BF_MAX_MEM'] = heap ### read by the bftools launch scripts
+    return args, env
+
+def build_command(args, inps, outs):
+    """ Returns the bfconvert or bioformats2raw command that converts inps to outs with the parameters in args, or None if the output type is unknown. """
+    cmd = []
+    keys = args.__dict__.keys()
+    if args.output_type == 'ometiff':
+        cmd += ["bfconvert"]
+        if "noflat" in keys:
+            cmd += ["-noflat"]
+        if "series" in keys:
+            cmd += ["-series", '%s' % args.series]
+        if "timepoint" in keys:
+            cmd += ["-timepoint", '%s' % args.timepoint]
+        if "channel" in keys:
+            cmd += ["-channel", '%s' % args.channel]
+        if "z_slice" in keys:
+            cmd += ["-z", '%s' % args.z_slice]
+        if "range" in keys:
+            _range = intlist(args.range)
+            if len(_range) != 2:
+                raise TypeError('Range must have two integers specifying first and last indices of images.')
+            else:
+                cmd += ["-range"]
+                for i in _range:
+                    cmd += ['%s' % i]
+        if "autoscale" in keys:
+            cmd += ["-autoscale"]
+        if "crop" in keys:
+            _crop = ''.join(args.crop[1:-1].split(' '))
+            cmd += ["-crop", '%s' % _crop]
+        if "compression_tiff" in keys:
+            cmd += ["-compression", '%s' % args.compression_tiff]
+        if "resolution_scale" in keys:
+            cmd += ["-pyramid-scale", '%s' % args.resolution_scale]
+        if "resolutions_tiff" in keys:
+            cmd += ["-pyramid-resolutions", '%s' % args.resolutions_tiff]
+        # add here all params
+    elif args.output_type == 'omezarr':
+        cmd += ["bioformats2raw"]
+        if "min_xy_size" in keys:
+            cmd += ["--target-min-size", '%s' % args.min_xy_size]
+        if "resolutions_zarr" in keys:
+            cmd += ["--resolutions", '%s' % args.resolutions_zarr]
+        if "chunk_y" in keys:
+            cmd += ["--tile_height", '%s' % args.chunk_y]
+        if "chunk_x" in keys:
+            cmd += ["--tile_width", '%s' % args.chunk_x]
+        if "chunk_z" in keys:
+            cmd += ["--chunk_depth", '%s' % args.chunk_z]
+        if "downsample_type" in keys:
+            cmd += ["--downsample-type", '%s' % args.downsample_type]
+        if "compression_zarr" in keys:
+            cmd += ["--compression", '%s' % args.compression_zarr]
+        if "max_workers" in keys:
+            cmd += ["--max_workers", '%s' % args.max_workers]
+        if "no_nested" in keys:
+            if args.no_nested in (True, "True"):
+                cmd += ["--no-nested"]
+            elif args.no_nested in (False, "False", None, "None"):
+                pass
+            else:
+                raise ValueError(f"--no-nested cannot have the value {args.no_nested}")
+        if "drop_series" in keys:
+            if args.drop_series in (True, "True"):
+                val = '%2$d'
+                cmd += ["--scale-format-string", val]
+            elif args.drop_series in (False, "False", None, "None"):
+                pass
+            else:
+                raise ValueError(f"--drop_series cannot have the value {args.drop_series}")
+        if "overwrite" in keys:
+            cmd += ["--overwrite"]
+    else:
+        return None
+    cmd.append(f"{inps}")
+    cmd.append(f"{outs}")
+    return cmd
+
+def run_command(cmd, capture = False, env = None):
+    """
+    Runs cmd and waits for it with os.wait4, which returns the resource usage of this child alone,
+    also when several conversions run in threads of this process.
+    Returns the return code, the output if capture is True, and the rusage of the child.
+    """
+    if capture:
+        proc = subprocess.Popen(cmd, shell = False, stdout = subprocess.PIPE, stderr = subprocess.STDOUT, universal_newlines = True, env = env)
+        log = proc.stdout.read()
+        proc.stdout.close()
+    else:
+        proc = subprocess.Popen(cmd, shell = False, env = env)
+        log = ''
+    pid, status, rusage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status) ### keeps Popen from waiting for the reaped child
+    return proc.returncode, log, rusage
+
+class TelemetryLog:
+    """ Appends one json record per conversion to a jsonl file. Records of concurrent conversions are written whole, one line each. """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.host = socket.gethostname()
+    def write(self, record):
+        record = dict(record, host = self.host, pid = os.getpid(), time = time.strftime('%Y-%m-%dT%H:%M:%S'))
+        line = json.dumps(record) + '\n'
+        with self.lock:
+            with open(self.path, 'a') as writer:
+                writer.write(line)
+
+def get_usage(rusage):
+    """ The telemetry fields of the rusage of a converter. """
+    ### ru_maxrss is in kilobytes on linux.
+    return {'user_time': rusage.ru_utime, 'system_time': rusage.ru_stime,
+            'max_rss': rusage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)}
+
+def get_output_size(outs):
+    return get_size(outs) if os.path.lexists(outs) else 0
+
+def convert(args, inps, outs, capture = False, env = None, cache = None, telemetry = None, stage = None):
+    """
+    Converts inps to outs. If inps is not a file, its path is written to outs instead.
+    With capture, the output of the converter is returned rather than printed.
+    stage is a function that returns a local copy of inps, which is then converted instead of inps.
+    With a ConversionCache, a cached output for the same input and command is placed at outs instead of
+    converting, and a new output is added to the cache.
+    Returns the return code of the converter, its output and 'hit' or 'miss' if a cache is used.
+    """
+    if not os.path.isfile(inps):
+        with open(outs, mode = 'w') as writer:
+            writer.write(inps)
+        return 0, '', None
+    cmd = build_command(args, inps, outs)
+    if cmd is None:
+        return 0, '', None
+    key = None
+    record = {'input_path': inps, 'output_path': outs, 'input_bytes': get_input_size(inps), 'command': cmd}
+    if env is not None:
+        record['heap'] = env.get('BF_MAX_MEM')
+    t0 = time.perf_counter()
+    if cache is not None:
+        key = cache.key(cmd, inps, outs)
+        if cache.fetch(key, outs):
+            print("cache hit: %s -> %s" % (inps, outs))
+            if telemetry is not None:
+                telemetry.write(dict(record, cache = 'hit', returncode = 0, wall = time.perf_counter() - t0, output_bytes = get_output_size(outs)))
+            return 0, '', 'hit'
+    if stage is not None:
+        t1 = time.perf_counter()
+        cmd = build_command(args, stage(), outs)
+        record['stage_wait'] = time.perf_counter() - t1
+    if not capture:
+        # cmdstr = ''.join(cmd)
+        print(cmd)
+        # sys.stdout.write(cmdstr)
+    returncode, log, rusage = run_command(cmd, capture, env)
+    if telemetry is not None:
+        telemetry.write(dict(record, cache = None if key is None else 'miss', returncode = returncode,
+                             wall = time.perf_counter() - t0, output_bytes = get_output_size(outs), **get_usage(rusage)))
+    if key is not None and returncode == 0 and os.path.exists(outs):
+        cache.put(key, outs)
+    return returncode, log, None if key is None else 'miss'
+
+def read_batch(manifest):
+    """
+    Reads the input/output pairs of a batch manifest. The manifest is a csv file with the columns
+    input_path and output_path, or a headerless csv file with one pair per row.
+    """
+    with open(manifest, 'r', newline = '') as csv_file:
+        rows = [row for row in csv.reader(csv_file) if len(row) > 0]
+    if len(rows) > 0 and rows[0][:2] == ['input_path', 'output_path']:
+        rows = rows[1:]
+    for i, row in enumerate(rows):
+        if len(row) < 2:
+            raise ValueError(f"Row {i + 1} of {manifest} must have an input and an output path.")
+    return [(row[0], row[1]) for row in rows]
+
+def convert_item(args, inps, outs, env = None, cache = None, telemetry = None, stager = None, index = None):
+    """ Converts a single item of a batch. Errors, including a missing input, are recorded in the returned dict instead of being raised. """
+    item = {'input_path': inps, 'output_path': outs}
+    t0 = time.perf_counter()
+    try:
+        if not os.path.exists(inps):
+            ### Unlike a single conversion, a batch does not write the path of a missing input into its output.
+            raise FileNotFoundError(f"The input {inps} does not exist.")
+        stage = None if stager is None else (lambda: stager.acquire(index))
+        returncode, log, status = convert(args, inps, outs, capture = True, env = env, cache = cache, telemetry = telemetry, stage = stage)
+        item['returncode'] = returncode
+        if status is not None:
+            item['cache'] = status
+        if returncode != 0:
+            item['error'] = log[-LOG_TAIL:]
+    except Exception as e:
+        item['returncode'] = None
+        item['error'] = '%s: %s' % (type(e).__name__, e)
+    finally:
+        if stager is not None and stager.is_acquired(index):
+            stager.release(index)
+    item['wall'] = time.perf_counter() - t0
+    return item
+
+def convert_batch(args, pairs, concurrency = 1, env = None, cache = None, telemetry = None, stager = None):
+    """ Converts the input/output pairs on a pool of concurrency threads, each running one converter at a time. Returns one report item per pair, in order. """
+    with ThreadPoolExecutor(max_workers = max(1, concurrency)) as executor:
+        futures = [executor.submit(convert_item, args, inps, outs, env, cache, telemetry, stager, index) for index, (inps, outs) in enumerate(pairs)]
+        report = []
+        for future in futures:
+            item = future.result()
+            status = 'ok' if item['returncode'] == 0 else 'failed'
+            if item.get('cache') == 'hit':
+                status = 'cached'
+            print("%s: %s -> %s (%.1f s)" % (status, item['input_path'], item['output_path'], item['wall']))
+            report.append(item)
+    return report
+
+def get_series_count(inps):
+    """ Number of series in inps, as reported by showinf. """
+    proc = subprocess.run(["showinf", "-nopix", "-nometa", inps], shell = False, stdout = subprocess.PIPE, stderr = subprocess.STDOUT, universal_newlines = True)
+    match = re.search(r'Series count = (\d+)', proc.stdout)
+    if match is None:
+        raise ValueError(f"The series count of {inps} could not be read from showinf:\n{proc.stdout[-LOG_TAIL:]}")
+    return int(match.group(1))
+
+def split_series(series_count, nshards):
+    """ Splits the series 0..series_count-1 into at most nshards contiguous, nearly equal lists. """
+    nshards = max(1, min(nshards, series_count))
+    size, rest = divmod(series_count, nshards)
+    shards, start = [], 0
+    for i in range(nshards):
+        stop = start + size + (1 if i < rest else 0)
+        shards.append(list(range(start, stop)))
+        start = stop
+    return shards
+
+def get_shard_path(outs, index):
+    return '%s.shard%s' % (os.path.normpath(outs), index)
+
+def check_sharding(args):
+    """ Raises a ValueError for parameters that a sharded conversion cannot honour. Called before any shard is converted. """
+    keys = args.__dict__.keys()
+    if args.output_type != 'omezarr':
+        ### Separate bfconvert runs do not write the cross-referenced OME-XML of a multi-file OME-TIFF set.
+        raise ValueError("Sharded conversion is only supported for the omezarr output type.")
+    if "series" in keys:
+        raise ValueError("A sharded conversion selects the series itself and cannot be combined with the series parameter.")
+    if "drop_series" in keys and args.drop_series in (True, "True"):
+        ### Without the series level, the shards cannot be told apart from resolution levels when they are assembled.
+        raise ValueError("A sharded conversion needs the series level of the OME-Zarr hierarchy. Set drop_series to False.")
+
+def remove_shards(outs, nshards):
+    for index in range(nshards):
+        shutil.rmtree(get_shard_path(outs, index), ignore_errors = True)
+
+def build_shard_commands(args, inps, outs, series, index):
+    """ Returns the bioformats2raw command that converts the given series of inps into the shard index of outs. """
+    cmd = build_command(args, inps, get_shard_path(outs, index))
+    return [cmd[:1] + ["--series", ','.join(['%s' % item for item in series])] + cmd[1:]]
+
+def convert_shard(args, inps, outs, series, index, env = None, telemetry = None):
+    """
+    Converts one shard. Returns the return code of the first failing command, or 0, and the output of the commands.
+    With a TelemetryLog, a record is written for each command, with the shard index and its first and last series.
+    """
+    logs = []
+    for cmd in build_shard_commands(args, inps, outs, series, index):
+        t0 = time.perf_counter()
+        returncode, log, rusage = run_command(cmd, capture = True, env = env)
+        if telemetry is not None:
+            path = get_shard_path(outs, index)
+            telemetry.write({'input_path': inps, 'output_path': path, 'input_bytes': get_input_size(inps), 'command': cmd,
+                             'heap': None if env is None else env.get('BF_MAX_MEM'), 'shard': index, 'series': [series[0], series[-1]],
+                             'returncode': returncode, 'wall': time.perf_counter() - t0, 'output_bytes': get_output_size(path),
+                             **get_usage(rusage)})
+        logs.append(log)
+        if returncode != 0:
+            return returncode, ''.join(logs)
+    return 0, ''.join(logs)
+
+def assemble_shards(args, outs, shards):
+    """
+    Combines the shard outputs into outs. The OME-Zarr shards hold their series as numbered groups, which are moved
+    into one hierarchy under their series index in the input. The layout attributes and the OME group are taken from
+    the first shard; the Image elements of the OME-XML are collected from all shards and the series list in
+    OME/.zattrs is rewritten, so that the result matches a single-process conversion. Plate (HCS) outputs, whose
+    series are not numbered groups, are rejected.
+    """
+    paths = [get_shard_path(outs, index) for index in range(len(shards))]
+    for path in paths:
+        if not os.path.isdir(path):
+            raise ValueError(f"The shard {path} is missing.")
+        if is_plate(path):
+            raise ValueError(f"The shard {path} is a plate. Plate (HCS) outputs cannot be assembled from shards.")
+    if os.path.exists(outs):
+        shutil.rmtree(outs)
+    os.makedirs(outs)
+    try:
+        move_shards(outs, paths, shards)
+    except BaseException:
+        shutil.rmtree(outs, ignore_errors = True)
+        raise
+    for path in paths:
+        shutil.rmtree(path)
+    return outs
+
+def is_plate(path):
+    """ True if the OME-Zarr at path is written in the plate layout, i.e. its root attributes have a plate. """
+    attrs = os.path.join(path, '.zattrs')
+    if not os.path.exists(attrs):
+        return False
+    with open(attrs, 'r') as reader:
+        return 'plate' in json.load(reader)
+
+def get_image_index(image):
+    match = re.fullmatch(r'Image:(\d+)', image.get('ID', ''))
+    if match is None:
+        raise ValueError(f"The OME-XML image ID {image.get('ID')} is not numbered.")
+    return int(match.group(1))
+
+def renumber_ids(element, old, new):
+    """ Changes the index old of the Image, Pixels, Channel and Plane IDs in element and its children to new. """
+    pattern = re.compile(r'^(Image|Pixels|Channel|Plane):%s(?=$|:)' % old)
+    for node in element.iter():
+        for name, value in node.attrib.items():
+            node.set(name, pattern.sub(lambda match: '%s:%s' % (match.group(1), new), value))
+
+def select_images(path, series):
+    """
+    Returns the Image elements of the OME-XML at path, which describe the given series of the input, renumbered to
+    their series indices. The OME-XML of a shard may describe all series of the input or only its own ones.
+    """
+    root = ET.parse(path).getroot()
+    ns = root.tag[:root.tag.index('}') + 1] if root.tag.startswith('{') else ''
+    images = root.findall(ns + 'Image')
+    indices = [get_image_index(image) for image in images]
+    if len(images) == len(series) and indices == list(range(len(series))):
+        ### Only the selected series, renumbered from 0.
+        selected = list(zip(indices, series, images))
+    elif set(series) <= set(indices):
+        byindex = dict(zip(indices, images))
+        selected = [(item, item, byindex[item]) for item in series]
+    else:
+        raise ValueError(f"The OME-XML of {path} does not describe the series {series[0]}-{series[-1]}.")
+    for old, new, image in selected:
+        renumber_ids(image, old, new)
+    return [image for _, _, image in selected]
+
+def merge_ome_xml(dest, sources, shards):
+    """ Replaces the Image elements of the OME-XML at dest with those of the sources, one per shard, in series order. """
+    for _, (prefix, uri) in ET.iterparse(dest, events = ('start-ns',)):
+        ET.register_namespace(prefix, uri)
+    images = []
+    for path, series in zip(sources, shards):
+        images += select_images(path, series)
+    tree = ET.parse(dest)
+    root = tree.getroot()
+    ns = root.tag[:root.tag.index('}') + 1] if root.tag.startswith('{') else ''
+    children = list(root)
+    first = [i for i, child in enumerate(children) if child.tag == ns + 'Image']
+    position = first[0] if len(first) > 0 else len(children)
+    for child in children:
+        if child.tag == ns + 'Image':
+            root.remove(child)
+    for i, image in enumerate(images):
+        root.insert(position + i, image)
+    tree.write(dest, encoding = 'UTF-8', xml_declaration = True)
+
+def move_shards(outs, paths, shards):
+    """ Moves the series groups of the shards and the metadata of the first shard into outs, and merges the OME-XML of all shards. """
+    for path, series in zip(paths, shards):
+        ### bioformats2raw may number the selected series from 0, so the groups are mapped to the series in order.
+        groups = sorted([name for name in os.listdir(path) if name.isdigit()], key = int)
+        if len(groups) != len(series):
+            raise ValueError(f"The shard {path} has {len(groups)} series instead of {len(series)}.")
+        for group, item in zip(groups, series):
+            os.rename(os.path.join(path, group), os.path.join(outs, '%s' % item))
+    for name in os.listdir(paths[0]):
+        os.rename(os.path.join(paths[0], name), os.path.join(outs, name))
+    xml = os.path.join(outs, 'OME', 'METADATA.ome.xml')
+    if os.path.exists(xml):
+        merge_ome_xml(xml, [xml] + [os.path.join(path, 'OME', 'METADATA.ome.xml') for path in paths[1:]], shards)
+    attrs = os.path.join(outs, 'OME', '.zattrs')
+    if os.path.exists(attrs):
+        with open(attrs, 'r') as reader:
+            ome = json.load(reader)
+        ome['series'] = ['%s' % item for series in shards for item in series]
+        with open(attrs, 'w') as writer:
+            json.dump(ome, writer, indent = 4)
+
+def convert_sharded(args, inps, outs, nshards, series_count = None, concurrency = None, env = None, telemetry = None):
+    """ Converts inps in nshards shards of contiguous series, concurrency shards at a time, and assembles the result. Each shard gets a telemetry record. Returns the number of failed shards. """
+    check_sharding(args)
+    if series_count is None:
+        series_count = get_series_count(inps)
+    shards = split_series(series_count, nshards)
+    concurrency = len(shards) if concurrency is None else concurrency
+    try:
+        with ThreadPoolExecutor(max_workers = max(1, concurrency)) as executor:
+            futures = [executor.submit(convert_shard, args, inps, outs, series, index, env, telemetry) for index, series in enumerate(shards)]
+            failed = 0
+            for index, (series, future) in enumerate(zip(shards, futures)):
+                returncode, log = future.result()
+                print("%s: shard %s, series %s-%s" % ('ok' if returncode == 0 else 'failed', index, series[0], series[-1]))
+                if returncode != 0:
+                    sys.stderr.write("Shard %s of %s failed:\n%s\n" % (index, inps, log[-LOG_TAIL:]))
+                    failed += 1
+        if failed == 0:
+            assemble_shards(args, outs, shards)
+    finally:
+        remove_shards(outs, len(shards)) ### only left over if a shard or the assembly failed
+    return failed
+
 if __name__ == '__main__':
     homepath = os.environ.get('HOMEPATH')
     temppath = os.environ.get('TEMPPATH')
@@ -18,105 +550,135 @@ if __name__ == '__main__':
     paramfile = os.path.join(parampath, 'params.json')
 
     parser = argparse.ArgumentParser()
-    parser.add_argument('input_path')
-    parser.add_argument('output_path')
+    parser.add_argument('input_path', nargs = '?', default = None)
+    parser.add_argument('output_path', nargs = '?', default = None)
+    parser.add_argument('--batch', default = None,
+                        help = 'A csv file of input_path,output_path pairs, which are converted in this process instead of input_path.')
+    parser.add_argument('--concurrency', default = 1, type = intorauto,
+                        help = 'Number of conversions of a batch that run at the same time, or auto.')
+    parser.add_argument('--cache_dir', default = None,
+                        help = 'Directory of the conversion cache. Outputs are cached only if this is given.')
+    parser.add_argument('--cache_size', default = 1 << 40, type = int,
+                        help = 'Maximum size of the conversion cache in bytes. The least recently used outputs are evicted first.')
+    parser.add_argument('--cache_hash', default = False, action = 'store_true',
+                        help = 'Also identify the inputs by a hash of their first and last megabyte, not only by path, size and mtime.')
+    parser.add_argument('--cache_mode', default = 'hardlink', choices = ['hardlink', 'symlink', 'copy'],
+                        help = 'How a cached output is placed at the output path.')
+    parser.add_argument('--telemetry', default = None,
+                        help = 'Jsonl file, to which a record of the sizes, times, peak memory and exit code of each conversion is appended.')
+    parser.add_argument('--stage_dir', default = None,
+                        help = 'Node-local scratch directory, into which the inputs, or the files referred to by a pattern file, are copied before their conversion.')
+    parser.add_argument('--lookahead', default = 2, type = int,
+                        help = 'Number of following inputs of a batch that are copied to --stage_dir in the background.')
+    parser.add_argument('--auto', default = False, action = 'store_true',
+                        help = 'Pick the concurrency, max_workers and the JVM heap from the CPUs, the memory limit and the input sizes. '
+                               'Also enabled by max_workers or --concurrency being auto.')
+    parser.add_argument('--cpus', default = None, type = int,
+                        help = 'CPUs allocated to this task, e.g. task.cpus of Nextflow. Read from SLURM or the cgroup limits if not given. Used by the auto mode.')
+    parser.add_argument('--memory', default = None, type = int,
+                        help = 'Memory allocated to this task in bytes, or 0 if unknown. Read from SLURM or the cgroup limits if not given. Used by the auto mode.')
+    parser.add_argument('--shards', default = None, type = int,
+                        help = 'Split input_path into this many shards of contiguous series, convert them in parallel and assemble them into output_path. Only for omezarr.')
+    parser.add_argument('--shard', default = None, type = int,
+                        help = 'Convert only this shard of the --shards shards, e.g. in a separate task. Assemble them with --assemble.')
+    parser.add_argument('--assemble', default = False, action = 'store_true',
+                        help = 'Assemble the outputs of the --shards shards into output_path.')
+    parser.add_argument('--shard_concurrency', default = None, type = int,
+                        help = 'Number of shards converted at the same time with --shards. All of them by default, or as picked by the auto mode.')
+    parser.add_argument('--series_count', default = None, type = int,
+                        help = 'Number of series in input_path. Read with showinf if not given.')
+    parser.add_argument('--report', default = None,
+                        help = 'Json file, to which the result of each conversion of a batch is written.')
 
     # print("args are %s" % args)
     with open(paramfile, 'rt') as f:
         t_args = argparse.Namespace()
         t_args.__dict__.update(json.load(f))
         args = parser.parse_args(namespace=t_args)
-    # inps = args.input_path.replace("\ ", " ")
-    # outs = args.output_path.replace("\ ", " ")
-    inps = args.input_path
-    outs = args.output_path
-
-    cmd = []
-    keys = args.__dict__.keys()
-    if not os.path.isfile(inps):
-        with open(outs, mode = 'w') as writer:
-            writer.write(inps)
-    else:
-        if args.output_type == 'ometiff':
-            cmd += ["bfconvert"]
-            if "noflat" in keys:
-                cmd += ["-noflat"]
-            if "series" in keys:
-                cmd += ["-series", '%s' % args.series]
-            if "timepoint" in keys:
-                cmd += ["-timepoint", '%s' % args.timepoint]
-            if "channel" in keys:
-                cmd += ["-channel", '%s' % args.channel]
-            if "z_slice" in keys:
-                cmd += ["-z", '%s' % args.z_slice]
-            if "range" in keys:
-                _range = intlist(args.range)
-                if len(_range) != 2:
-                    raise TypeError('Range must have two integers specifying first and last indices of images.')
-                else:
-                    cmd += ["-range"]
-                    for i in _range:
-                        cmd += ['%s' % i]
-            if "autoscale" in keys:
-                cmd += ["-autoscale"]
-            if "crop" in keys:
-                _crop = ''.join(args.crop[1:-1].split(' '))
-                cmd += ["-crop", '%s' % _crop]
-            if "compression_tiff" in keys:
-                cmd += ["-compression", '%s' % args.compression_tiff]
-            if "resolution_scale" in keys:
-                cmd += ["-pyramid-scale", '%s' % args.resolution_scale]
-            if "resolutions_tiff" in keys:
-                cmd += ["-pyramid-resolutions", '%s' % args.resolutions_tiff]
-            # add here all params
-            cmd.append(f"{inps}")
-            cmd.append(f"{outs}")
-            # cmdstr = ''.join(cmd)
-            print(cmd)
-            # sys.stdout.write(cmdstr)
-            subprocess.run(cmd, shell = False)
-        elif args.output_type == 'omezarr':
-            cmd += ["bioformats2raw"]
-            if "min_xy_size" in keys:
-                cmd += ["--target-min-size", '%s' % args.min_xy_size]
-            if "resolutions_zarr" in keys:
-                cmd += ["--resolutions", '%s' % args.resolutions_zarr]
-            if "chunk_y" in keys:
-                cmd += ["--tile_height", '%s' % args.chunk_y]
-            if "chunk_x" in keys:
-                cmd += ["--tile_width", '%s' % args.chunk_x]
-            if "chunk_z" in keys:
-                cmd += ["--chunk_depth", '%s' % args.chunk_z]
-            if "downsample_type" in keys:
-                cmd += ["--downsample-type", '%s' % args.downsample_type]
-            if "compression_zarr" in keys:
-                cmd += ["--compression", '%s' % args.compression_zarr]
-            if "max_workers" in keys:
-                cmd += ["--max_workers", '%s' % args.max_workers]
-            if "no_nested" in keys:
-                if args.no_nested in (True, "True"):
-                    cmd += ["--no-nested"]
-                elif args.no_nested in (False, "False", None, "None"):
-                    pass
-                else:
-                    raise ValueError(f"--no-nested cannot have the value {args.no_nested}")
-            if "drop_series" in keys:
-                if args.drop_series in (True, "True"):
-                    val = '%2$d'
-                    cmd += ["--scale-format-string", val]
-                elif args.drop_series in (False, "False", None, "None"):
-                    pass
-                else:
-                    raise ValueError(f"--drop_series cannot have the value {args.drop_series}")
-            if "overwrite" in keys:
-                cmd += ["--overwrite"]
-            cmd.append(f"{inps}")
-            cmd.append(f"{outs}")
-            # cmdstr = ''.join(cmd)
-            print(cmd)
-            # sys.stdout.write(cmdstr)
-            subprocess.run(cmd, shell = False)
-
+    # inps = args.input_path.replace("\\ ", " ")
+    # outs = args.output_path.replace("\\ ", " ")
 
+    auto = args.auto or (args.concurrency == 'auto') or (getattr(args, 'max_workers', None) == 'auto')
+    env = None
+    cache = None
+    if args.cache_dir is not None:
+        cache = ConversionCache(args.cache_dir, max_size = args.cache_size, use_hash = args.cache_hash, mode = args.cache_mode)
 
+    telemetry = None
+    if args.telemetry is not None:
+        telemetry = TelemetryLog(args.telemetry)
 
+    if args.batch is not None:
+        pairs = read_batch(args.batch)
+        if auto:
+            tuning = auto_tune([get_input_size(inps) for inps, outs in pairs], args.cpus, args.memory or None)
+            args, env = apply_tuning(args, tuning)
+            concurrency = tuning['concurrency']
+            print("auto: %s" % json.dumps(tuning))
+        else:
+            concurrency = args.concurrency
+        stager = None
+        if args.stage_dir is not None:
+            def is_cached(index):
+                ### Cached conversions are not staged.
+                inps, outs = pairs[index]
+                cmd = build_command(args, inps, outs)
+                return cmd is not None and cache.contains(cache.key(cmd, inps, outs))
+            stager = Stager(args.stage_dir, [inps for inps, outs in pairs], lookahead = args.lookahead, workers = max(1, min(concurrency, args.lookahead)),
+                            skip = None if cache is None else is_cached)
+        try:
+            report = convert_batch(args, pairs, concurrency, env, cache, telemetry, stager)
+        finally:
+            if stager is not None:
+                stager.close()
+                print(stager.report())
+        failed = [item for item in report if item['returncode'] != 0]
+        if args.report is not None:
+            with open(args.report, 'w') as writer:
+                json.dump(report, writer, indent = 1)
+        for item in failed:
+            sys.stderr.write("Conversion of %s failed:\n%s\n" % (item['input_path'], item['error']))
+        print("%s of %s conversions succeeded." % (len(report) - len(failed), len(report)))
+        if len(failed) > 0:
+            sys.exit(1)
+    else:
+        if (args.input_path is None) or (args.output_path is None):
+            parser.error('input_path and output_path are required unless --batch is given.')
+        inps = args.input_path
+        outs = args.output_path
+        if auto:
+            ### A single conversion gets all CPUs and memory of the task, shards share them.
+            nshards = 1 if args.shards is None else args.shards
+            tuning = auto_tune([get_input_size(inps) // nshards] * nshards, args.cpus, args.memory or None)
+            args, env = apply_tuning(args, tuning)
+            print("auto: %s" % json.dumps(tuning))
+        if args.shards is None:
+            stager = None
+            if args.stage_dir is not None:
+                stager = Stager(args.stage_dir, [inps], lookahead = 0)
+            try:
+                convert(args, inps, outs, env = env, cache = cache, telemetry = telemetry, stage = None if stager is None else (lambda: stager.acquire(0)))
+            finally:
+                if stager is not None:
+                    stager.close()
+                    print(stager.report())
+        else:
+            check_sharding(args)
+            series_count = args.series_count if args.series_count is not None else get_series_count(inps)
+            shards = split_series(series_count, args.shards)
+            if args.assemble:
+                assemble_shards(args, outs, shards)
+            elif args.shard is not None:
+                if not 0 <= args.shard < len(shards):
+                    raise ValueError(f"The shard must be between 0 and {len(shards) - 1}.")
+                returncode, log = convert_shard(args, inps, outs, shards[args.shard], args.shard, env, telemetry)
+                print(log)
+                if returncode != 0:
+                    shutil.rmtree(get_shard_path(outs, args.shard), ignore_errors = True)
+                sys.exit(returncode)
+            else:
+                concurrency = args.shard_concurrency
+                if concurrency is None and auto:
+                    concurrency = tuning['concurrency']
+                if convert_sharded(args, inps, outs, args.shards, series_count, concurrency, env, telemetry) > 0:
+                    sys.exit(1)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+"""
+Uploads an OME-Zarr output to S3 while it is being written.
+
+The uploader scans the output directory during the conversion and uploads the chunk files once they have not
+changed for a settle time. When the conversion has exited, the remaining chunk files are uploaded and the
+metadata files (.zattrs, .zgroup, .zarray, .zmetadata, zarr.json) are uploaded last, deepest first, so a reader
+of the bucket never finds the metadata of a dataset before its chunks. A file that changes after its upload is
+uploaded again.
+
+The client can be any object with the upload_file(path, bucket, key) method of a boto3 S3 client, such as a client
+of moto or of a local MinIO server. boto3 is only needed when the client is created from an endpoint.
+
+    s3_uploader.py --endpoint https://s3.example.org --bucket bucket --prefix out/path --watch x.ome.zarr -- run_conversion.py x.czi x.ome.zarr
+"""
+
+import os, sys, time
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait
+
+try:
+    import boto3
+except ImportError:
+    boto3 = None
+
+METADATA_NAMES = ('.zattrs', '.zgroup', '.zarray', '.zmetadata', 'zarr.json')
+
+def is_metadata(path):
+    return os.path.basename(path) in METADATA_NAMES
+
+def make_client(endpoint = None, access_key = None, secret_key = None, region = None):
+    if boto3 is None:
+        raise ImportError("boto3 is required to create an S3 client from an endpoint. Install it or pass a client.")
+    return boto3.client('s3', endpoint_url = endpoint, aws_access_key_id = access_key,
+                        aws_secret_access_key = secret_key, region_name = region)
+
+class StreamingUploader:
+    def __init__(self, client, bucket, prefix, root, workers = 8, settle = 2.0):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.root = os.path.abspath(root)
+        self.settle = settle
+        self.executor = ThreadPoolExecutor(max_workers = workers)
+        self.uploaded = {} ### path -> (size, mtime) of the uploaded version
+        self.pending = {} ### path -> future of a running upload
+        self.stats = {'files': 0, 'bytes': 0, 'reuploads': 0, 'scans': 0}
+    def get_key(self, path):
+        relpath = os.path.relpath(path, os.path.dirname(self.root))
+        return '/'.join([item for item in (self.prefix, relpath.replace(os.sep, '/')) if item != ''])
+    def __upload(self, path, version):
+        self.client.upload_file(path, self.bucket, self.get_key(path))
+        return version
+    def __submit(self, path, version):
+        if path in self.uploaded:
+            self.stats['reuploads'] += 1
+        self.uploaded[path] = version
+        self.stats['files'] += 1
+        self.stats['bytes'] += version[0]
+        self.pending[path] = self.executor.submit(self.__upload, path, version)
+    def __collect(self, block = False):
+        """ Raises the first upload error and forgets the finished uploads. """
+        if block:
+            wait(list(self.pending.values()))
+        for path, future in list(self.pending.items()):
+            if future.done():
+                future.result()
+                del self.pending[path]
+    def scan(self, final = False):
+        """
+        Uploads the data files that are new or changed since their upload and have settled, or all of them if final is True.
+        Metadata files are skipped. Returns the metadata files found.
+        """
+        self.stats['scans'] += 1
+        self.__collect()
+        now = time.time()
+        metadata = []
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                if is_metadata(path):
+                    metadata.append(path)
+                    continue
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                version = (st.st_size, st.st_mtime_ns)
+                if self.uploaded.get(path) == version or path in self.pending:
+                    continue
+                if final or now - st.st_mtime >= self.settle:
+                    self.__submit(path, version)
+        return metadata
+    def finish(self):
+        """ Uploads the remaining data files, waits for them, then uploads the metadata files deepest first. """
+        metadata = self.scan(final = True)
+        self.__collect(block = True)
+        ### A data file may have been rewritten while its upload was running.
+        metadata = self.scan(final = True)
+        self.__collect(block = True)
+        metadata.sort(key = lambda path: (-path.count(os.sep), path))
+        for path in metadata:
+            st = os.stat(path)
+            version = (st.st_size, st.st_mtime_ns)
+            if self.uploaded.get(path) != version:
+                self.__submit(path, version)
+                self.__collect(block = True)
+        self.executor.shutdown()
+        return self.stats
+    def watch(self, proc, interval = 1.0):
+        """ Scans the output every interval seconds until proc, a Popen object, has exited, then finishes the upload. Returns the exit code of proc. If an upload fails, proc is terminated and the error is raised. """
+        try:
+            while proc.poll() is None:
+                if os.path.isdir(self.root):
+                    self.scan()
+                time.sleep(interval)
+            if proc.returncode == 0:
+                self.finish()
+            else:
+                self.__collect(block = True)
+                self.executor.shutdown()
+        except BaseException:
+            ### A failed upload must not leave the conversion running.
+            if proc.poll() is None:
+                proc.terminate()
+                proc.wait()
+            self.executor.shutdown(wait = True, cancel_futures = True)
+            raise
+        return proc.returncode
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Runs a conversion command and uploads its output to S3 while it is being written.')
+    parser.add_argument('--watch', required = True, help = 'The output directory of the command.')
+    parser.add_argument('--bucket', required = True)
+    parser.add_argument('--prefix', default = '', help = 'Key prefix, under which the output directory is uploaded.')
+    parser.add_argument('--endpoint', default = os.environ.get('S3ENDPOINT'))
+    parser.add_argument('--access_key', default = os.environ.get('S3ACCESS'))
+    parser.add_argument('--secret_key', default = os.environ.get('S3SECRET'))
+    parser.add_argument('--region', default = None)
+    parser.add_argument('--workers', default = 8, type = int, help = 'Number of concurrent uploads.')
+    parser.add_argument('--settle', default = 2.0, type = float, help = 'Seconds, for which a chunk file must be unchanged before it is uploaded.')
+    parser.add_argument('--interval', default = 1.0, type = float, help = 'Seconds between two scans of the output directory.')
+    parser.add_argument('command', nargs = argparse.REMAINDER, help = 'The conversion command, after --.')
+    args = parser.parse_args()
+
+    command = args.command[1:] if args.command[:1] == ['--'] else args.command
+    uploader = StreamingUploader(make_client(args.endpoint, args.access_key, args.secret_key, args.region),
+                                 args.bucket, args.prefix, args.watch, workers = args.workers, settle = args.settle)
+    if len(command) > 0:
+        returncode = uploader.watch(subprocess.Popen(command), interval = args.interval)
+    else:
+        uploader.finish()
+        returncode = 0
+    print("%(files)s files, %(bytes)s bytes uploaded (%(reuploads)s reuploads, %(scans)s scans)" % uploader.stats)
+    sys.exit(returncode)
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+"""
+Stages the inputs of conversions on node-local scratch.
+
+A Stager copies the input of a conversion, or every file a pattern file refers to together with the pattern
+file itself, into its own directory under the scratch directory, reading each file sequentially in large
+blocks. For other inputs, the files that Bio-Formats reports as used by the input, such as the _x_ directory of
+a .vsi file or the companion files of an OME-TIFF, are copied along with it. An input, whose used files cannot
+be listed or lie outside its directory, is converted from its original path. In a batch, the inputs of the next lookahead conversions are copied in the background while the
+current ones are converted, and a staged copy is removed as soon as its conversion is done. The stats record
+the bytes prefetched, the time spent copying and the time the conversions waited for their copies; the
+difference is the copy time hidden behind the conversions.
+"""
+
+import os, re, time
+import subprocess
+import itertools
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+COPY_BLOCK = 16 << 20
+
+def expand_block(block):
+    """ Expands the content of a <> block of a pattern: <7>, <1,3,7> or <01-12:1>. """
+    if ',' in block:
+        return block.split(',')
+    match = re.fullmatch(r'(\d+)-(\d+)(?::(\d+))?', block)
+    if match is None:
+        return [block]
+    first, last, step = match.group(1), match.group(2), int(match.group(3) or 1)
+    width = len(first) if len(first) == len(last) else 0
+    return [str(value).zfill(width) for value in range(int(first), int(last) + 1, step)]
+
+def get_pattern_files(pattern_path):
+    """ Returns the paths of the existing files, which a pattern file refers to. Paths in the pattern are relative to the pattern file. """
+    with open(pattern_path, 'r') as reader:
+        pattern = reader.read().strip()
+    parts = re.split(r'<([^<>]*)>', pattern)
+    literals, blocks = parts[0::2], [expand_block(block) for block in parts[1::2]]
+    dirname = os.path.dirname(pattern_path)
+    paths = []
+    for values in itertools.product(*blocks):
+        name = ''.join(literal + value for literal, value in itertools.zip_longest(literals, values, fillvalue = ''))
+        path = os.path.join(dirname, name)
+        if os.path.exists(path):
+            paths.append(path)
+    return paths
+
+def copy_sequential(source, dest):
+    """ Copies source to dest in COPY_BLOCK reads, following symlinks, and returns the number of bytes copied. """
+    size = 0
+    with open(source, 'rb') as reader, open(dest, 'wb') as writer:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(reader.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        while True:
+            block = reader.read(COPY_BLOCK)
+            if not block:
+                break
+            writer.write(block)
+            size += len(block)
+    shutil.copystat(source, dest)
+    return size
+
+def get_used_files(inps):
+    """
+    Returns the files that Bio-Formats reads for inps, as listed by showinf, or None if showinf fails.
+    showinf lists the used files only if there are several of them, or if the only one is not inps itself.
+    """
+    try:
+        proc = subprocess.run(["showinf", "-nopix", "-nometa", inps], shell = False, stdout = subprocess.PIPE,
+                              stderr = subprocess.STDOUT, universal_newlines = True)
+    except OSError:
+        return None
+    if proc.returncode != 0:
+        return None
+    lines = proc.stdout.splitlines()
+    if 'Used files:' in lines:
+        used = itertools.takewhile(lambda line: line.startswith('\t'), lines[lines.index('Used files:') + 1:])
+        return [os.path.abspath(line.strip()) for line in used]
+    for line in lines:
+        match = re.fullmatch(r'Used files = \[(.+)\]', line.strip())
+        if match is not None:
+            return [os.path.abspath(match.group(1))]
+    return [os.path.abspath(inps)]
+
+def stage_input(inps, stagedir):
+    """
+    Copies inps, and the files it refers to if it is a pattern file or the other files it uses otherwise, into
+    stagedir. Returns the staged input path and the bytes copied. If the used files cannot be staged together,
+    inps is returned as it is and nothing is copied.
+    """
+    base = os.path.dirname(os.path.abspath(inps))
+    if inps.endswith('.pattern'):
+        paths = get_pattern_files(inps)
+    else:
+        paths = get_used_files(inps)
+        if paths is None or any(os.path.relpath(path, base).split(os.sep)[0] == os.pardir for path in paths):
+            return inps, 0
+        paths = [path for path in paths if path != os.path.abspath(inps)]
+    size = 0
+    for path in paths:
+        dest = os.path.join(stagedir, os.path.relpath(path, base))
+        os.makedirs(os.path.dirname(dest), exist_ok = True)
+        size += copy_sequential(path, dest)
+    dest = os.path.join(stagedir, os.path.basename(inps))
+    size += copy_sequential(inps, dest)
+    return dest, size
+
+class Stager:
+    """
+    skip is an optional function of an input index, which is True for inputs that need no staging, e.g. cached
+    conversions. Such inputs are not copied in the background; if one is acquired anyway, it is copied then.
+    """
+    def __init__(self, scratch_dir, inputs, lookahead = 2, workers = 2, skip = None):
+        self.scratch_dir = scratch_dir
+        self.inputs = list(inputs)
+        self.lookahead = lookahead
+        self.skip = skip
+        os.makedirs(scratch_dir, exist_ok = True)
+        self.executor = ThreadPoolExecutor(max_workers = max(1, workers))
+        self.lock = threading.Lock()
+        self.futures = {}
+        self.stagedirs = {}
+        self.acquired = set()
+        self.released = set()
+        self.stats = {'staged': 0, 'bytes': 0, 'copy_time': 0.0, 'wait_time': 0.0}
+    def __stage(self, index, check = True):
+        if check and self.skip is not None and self.skip(index):
+            return None
+        t0 = time.perf_counter()
+        stagedir = self.stagedirs[index]
+        path, size = stage_input(self.inputs[index], stagedir)
+        with self.lock:
+            self.stats['staged'] += 1
+            self.stats['bytes'] += size
+            self.stats['copy_time'] += time.perf_counter() - t0
+        return path
+    def prefetch(self, index):
+        """ Starts copying the inputs index to index + lookahead that are neither staged nor released yet. """
+        with self.lock:
+            for i in range(index, min(index + self.lookahead + 1, len(self.inputs))):
+                if i not in self.futures and i not in self.released and os.path.isfile(self.inputs[i]):
+                    self.stagedirs[i] = tempfile.mkdtemp(prefix = 'stage_%s_' % i, dir = self.scratch_dir)
+                    self.futures[i] = self.executor.submit(self.__stage, i)
+    def acquire(self, index):
+        """ Returns the staged copy of input index, waiting for it if needed, and prefetches the following inputs. Inputs that are not files are returned as they are. """
+        self.prefetch(index)
+        future = self.futures.get(index)
+        if future is None:
+            return self.inputs[index]
+        with self.lock:
+            self.acquired.add(index)
+        t0 = time.perf_counter()
+        path = future.result()
+        if path is None: ### skipped in the background, but needed after all
+            path = self.__stage(index, check = False)
+        with self.lock:
+            self.stats['wait_time'] += time.perf_counter() - t0
+        return path
+    def is_acquired(self, index):
+        with self.lock:
+            return index in self.acquired
+    def release(self, index):
+        """ Removes the staged copy of input index. A copy that is still being made is cancelled or waited for first. """
+        with self.lock:
+            self.released.add(index)
+            self.acquired.discard(index)
+            future = self.futures.pop(index, None)
+            stagedir = self.stagedirs.pop(index, None)
+        if future is not None and not future.cancel():
+            try:
+                future.result()
+            except Exception:
+                pass
+        if stagedir is not None:
+            shutil.rmtree(stagedir, ignore_errors = True)
+    def close(self):
+        self.executor.shutdown(wait = True, cancel_futures = True)
+        for index in list(self.stagedirs):
+            self.release(index)
+    def report(self):
+        hidden = max(0.0, self.stats['copy_time'] - self.stats['wait_time'])
+        return "staged %s inputs, %s bytes prefetched in %.1f s, %.1f s hidden behind conversions, %.1f s waited" % (
+            self.stats['staged'], self.stats['bytes'], self.stats['copy_time'], hidden, self.stats['wait_time'])
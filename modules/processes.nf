@@ -26,7 +26,7 @@ process Convert_EachFileFromRoot2SeparateOMETIFF {
 
     script:
     """
-    ${params.binpath}/run_conversion.py "$root/$inpath" "${inpath.baseName}.ome.tiff"
+    ${params.binpath}/run_conversion.py "$root/$inpath" "${inpath.baseName}.ome.tiff" --cpus ${task.cpus} --memory ${task.memory ? task.memory.toBytes() : 0}
     """
 }
 
@@ -48,7 +48,7 @@ process Convert_EachFile2SeparateOMETIFF {
     script:
     template 'makedirs.sh "${params.out_path}"'
     """
-    ${params.binpath}/run_conversion.py "$inpath.name" "${inpath.baseName}.ome.tiff"
+    ${params.binpath}/run_conversion.py "$inpath.name" "${inpath.baseName}.ome.tiff" --cpus ${task.cpus} --memory ${task.memory ? task.memory.toBytes() : 0}
     """
 }
 
@@ -73,9 +73,9 @@ process Convert_Concatenate2SingleOMETIFF {
     """
     if [[ -d "${inpath}/tempdir" ]];
         then
-            ${params.binpath}/run_conversion.py "${inpath}/tempdir/${pattern_file}" "${pattern_file.baseName}.ome.tiff"
+            ${params.binpath}/run_conversion.py "${inpath}/tempdir/${pattern_file}" "${pattern_file.baseName}.ome.tiff" --cpus ${task.cpus} --memory ${task.memory ? task.memory.toBytes() : 0}
         else
-            ${params.binpath}/run_conversion.py "$inpath/$pattern_file.name" "${pattern_file.baseName}.ome.tiff"
+            ${params.binpath}/run_conversion.py "$inpath/$pattern_file.name" "${pattern_file.baseName}.ome.tiff" --cpus ${task.cpus} --memory ${task.memory ? task.memory.toBytes() : 0}
     fi
     # rm -rf ${inpath}/tempdir &> /dev/null
     # rm -rf ${inpath}/*pattern &> /dev/null
@@ -104,9 +104,9 @@ process Convert_EachFileFromRoot2SeparateOMEZARR {
     """
     if echo "$root" | grep -q "*";
         then
-            ${params.binpath}/run_conversion.py "\$(dirname "$root")/$inpath" "${inpath.baseName}.ome.zarr"
+            ${params.binpath}/run_conversion.py "\$(dirname "$root")/$inpath" "${inpath.baseName}.ome.zarr" --cpus ${task.cpus} --memory ${task.memory ? task.memory.toBytes() : 0}
         else
-            ${params.binpath}/run_conversion.py "$root/$inpath" "${inpath.baseName}.ome.zarr"
+            ${params.binpath}/run_conversion.py "$root/$inpath" "${inpath.baseName}.ome.zarr" --cpus ${task.cpus} --memory ${task.memory ? task.memory.toBytes() : 0}
     fi
     """
 }
@@ -128,7 +128,7 @@ process Convert_EachFile2SeparateOMEZARR {
     script:
     template 'makedirs.sh "${params.out_path}"'
     """
-    ${params.binpath}/run_conversion.py "$inpath.name" "${inpath.baseName}.ome.zarr"
+    ${params.binpath}/run_conversion.py "$inpath.name" "${inpath.baseName}.ome.zarr" --cpus ${task.cpus} --memory ${task.memory ? task.memory.toBytes() : 0}
     """
 }
 
@@ -154,9 +154,9 @@ process Convert_Concatenate2SingleOMEZARR{
     """
     if [[ -d "${inpath}/tempdir" ]];
         then
-            ${params.binpath}/run_conversion.py "${inpath}/tempdir/${pattern_file.name}" "${pattern_file.baseName}.ome.zarr"
+            ${params.binpath}/run_conversion.py "${inpath}/tempdir/${pattern_file.name}" "${pattern_file.baseName}.ome.zarr" --cpus ${task.cpus} --memory ${task.memory ? task.memory.toBytes() : 0}
         else
-            ${params.binpath}/run_conversion.py "$inpath/$pattern_file.name" "${pattern_file.baseName}.ome.zarr"
+            ${params.binpath}/run_conversion.py "$inpath/$pattern_file.name" "${pattern_file.baseName}.ome.zarr" --cpus ${task.cpus} --memory ${task.memory ? task.memory.toBytes() : 0}
     fi
     # rm -rf ${inpath}/tempdir &> /dev/null
     # rm -rf ${inpath}/*pattern &> /dev/null
@@ -0,0 +1,4 @@
+import os, sys
+
+BINPATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bin')
+sys.path.insert(0, BINPATH)
@@ -0,0 +1,39 @@
+import os
+
+import pytest
+
+from conftest import BINPATH
+import run_conversion
+from run_conversion import auto_tune, get_allocation
+
+@pytest.fixture
+def unlimited(monkeypatch):
+    """ A node without SLURM and cgroup limits, as with the local executor. """
+    for name in ('SLURM_CPUS_PER_TASK', 'SLURM_MEM_PER_NODE', 'SLURM_MEM_PER_CPU'):
+        monkeypatch.delenv(name, raising = False)
+    monkeypatch.setattr(run_conversion, 'read_cgroup_value', lambda path: None)
+    monkeypatch.setattr(os, 'sched_getaffinity', lambda pid: set(range(os.cpu_count() or 1)), raising = False)
+    return monkeypatch
+
+def test_auto_mode_is_refused_without_an_allocation(unlimited):
+    with pytest.raises(ValueError, match = '--cpus'):
+        auto_tune([1 << 20])
+
+def test_slurm_allocation(unlimited):
+    unlimited.setenv('SLURM_CPUS_PER_TASK', '2')
+    unlimited.setenv('SLURM_MEM_PER_CPU', '4096')
+    assert get_allocation() == (2, 8 << 30)
+
+def test_memory_share_of_the_given_cpus(unlimited):
+    physical = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    cpus, memory = get_allocation(cpus = 1)
+    assert cpus == 1
+    assert memory == physical // (os.cpu_count() or 1)
+    assert auto_tune([1 << 20], cpus = 1)['max_workers'] == 1
+
+def test_pattern_size_counts_only_its_files(tmp_path):
+    for group in ('a', 'b', 'c'):
+        for t in range(3):
+            (tmp_path / ('%s_t%s.tif' % (group, t))).write_bytes(b'x' * 100000)
+        (tmp_path / ('%s_t_range.pattern' % group)).write_text('%s_t<0-2>.tif' % group)
+    assert run_conversion.get_input_size(str(tmp_path / 'a_t_range.pattern')) == 300000
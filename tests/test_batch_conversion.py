@@ -0,0 +1,16 @@
+import argparse, os
+
+from conftest import BINPATH
+from run_conversion import convert_batch
+
+def test_missing_input_fails(tmp_path, capsys):
+    inps = tmp_path / 'present.czi'
+    inps.write_bytes(b'data')
+    args = argparse.Namespace(output_type = None) ### no converter command, so an existing input succeeds trivially
+    pairs = [(str(inps), str(tmp_path / 'o1.ome.zarr')), (str(tmp_path / 'missing.czi'), str(tmp_path / 'o2.ome.zarr'))]
+    report = convert_batch(args, pairs, concurrency = 2)
+    assert report[0]['returncode'] == 0
+    assert report[1]['returncode'] is None
+    assert 'does not exist' in report[1]['error']
+    assert not os.path.exists(tmp_path / 'o2.ome.zarr')
+    assert 'failed: %s' % pairs[1][0] in capsys.readouterr().out
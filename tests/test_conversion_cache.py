@@ -0,0 +1,75 @@
+import os
+
+import pytest
+
+from conftest import BINPATH
+from cache_store import CacheStore
+from conversion_cache import ConversionCache
+
+def write_file(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    with open(path, 'wb') as writer:
+        writer.write(content)
+    return path
+
+def make_command(inps, outs, max_workers = 4, resolutions = 3):
+    return ['bioformats2raw', '--resolutions', '%s' % resolutions, '--max_workers', '%s' % max_workers, inps, outs]
+
+def test_hit_and_miss(tmp_path):
+    inps = write_file(str(tmp_path / 'in' / 'x.czi'), b'input')
+    outs = str(tmp_path / 'out' / 'x.ome.zarr')
+    write_file(os.path.join(outs, '0', '0.0'), b'chunk')
+    cache = ConversionCache(str(tmp_path / 'cache'))
+    key = cache.key(make_command(inps, outs), inps, outs)
+    assert cache.key(make_command(inps, outs, max_workers = 16), inps, outs) == key
+    assert cache.key(make_command(inps, outs, resolutions = 4), inps, outs) != key
+    assert not cache.fetch(key, outs)
+    cache.put(key, outs)
+    other = str(tmp_path / 'other' / 'x.ome.zarr')
+    os.makedirs(os.path.dirname(other))
+    assert cache.fetch(cache.key(make_command(inps, other, max_workers = 16), inps, other), other)
+    with open(os.path.join(other, '0', '0.0'), 'rb') as reader:
+        assert reader.read() == b'chunk'
+
+def test_eviction_skips_pinned_entry(tmp_path):
+    store = CacheStore(str(tmp_path / 'cache'), max_size = 150)
+    def commit(key):
+        staging = store.create()
+        write_file(os.path.join(staging, 'output'), b'x' * 100)
+        store.commit(key, staging)
+    commit('a')
+    with store.pin('a') as (path, size):
+        assert size == 100
+        commit('b') ### would evict a, which is pinned
+        assert os.path.exists(os.path.join(path, 'output'))
+    assert store.contains('a') and store.contains('b')
+    commit('c')
+    assert not store.contains('a') and not os.path.exists(store.path('a'))
+    assert store.contains('c')
+
+def test_truncated_entry_is_invalidated(tmp_path):
+    inps = write_file(str(tmp_path / 'in' / 'x.czi'), b'input')
+    outs = str(tmp_path / 'out' / 'x.ome.tiff')
+    write_file(outs, b'converted image')
+    cache = ConversionCache(str(tmp_path / 'cache'))
+    key = cache.key(make_command(inps, outs), inps, outs)
+    cache.put(key, outs)
+    os.remove(outs) ### the entry is a hardlink of the output, which is truncated on its own below
+    with open(os.path.join(cache.store.path(key), 'output'), 'wb') as writer:
+        writer.write(b'conv')
+    assert not cache.fetch(key, outs)
+    assert not cache.contains(key)
+    assert not os.path.lexists(outs)
+
+def test_pattern_key_follows_its_files(tmp_path):
+    for t in range(2):
+        write_file(str(tmp_path / 'in' / ('img_t%s.tif' % t)), b'plane')
+    unrelated = write_file(str(tmp_path / 'in' / 'other.tif'), b'other')
+    inps = write_file(str(tmp_path / 'in' / 'img_t_range.pattern'), b'img_t<0-1>.tif')
+    outs = str(tmp_path / 'out' / 'img.ome.zarr')
+    cache = ConversionCache(str(tmp_path / 'cache'))
+    key = cache.key(make_command(inps, outs), inps, outs)
+    write_file(unrelated, b'changed other')
+    assert cache.key(make_command(inps, outs), inps, outs) == key
+    write_file(str(tmp_path / 'in' / 'img_t1.tif'), b'changed plane')
+    assert cache.key(make_command(inps, outs), inps, outs) != key
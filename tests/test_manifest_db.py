@@ -0,0 +1,76 @@
+import csv, os, sys
+import subprocess
+
+import pytest
+
+from conftest import BINPATH
+from manifest_db import build_manifest, read_rows, read_column, read_csv_rows, verify_manifest, ManifestReader
+
+def write_csv(path, fieldnames, rows):
+    with open(path, 'w', newline = '') as writer:
+        csv_writer = csv.DictWriter(writer, fieldnames = fieldnames)
+        csv_writer.writeheader()
+        csv_writer.writerows(rows)
+
+@pytest.fixture
+def filelist(tmp_path):
+    rows = []
+    for i in range(2500):
+        rows.append({'Root': 'root/plate%s' % (i % 3),
+                     'Image': 'well %s/img_t%03d.tif' % (i % 7, i),
+                     'Note': 'quoted, "value"\nwith a newline' if i % 11 == 0 else ''})
+    path = str(tmp_path / 'FileList.csv')
+    write_csv(path, ['Root', 'Image', 'Note'], rows)
+    return path, rows
+
+def test_round_trip(filelist, tmp_path):
+    path, rows = filelist
+    db_path = str(tmp_path / 'FileList.sqlite')
+    assert build_manifest(path, db_path, index_columns = ['Image']) == len(rows)
+    assert list(read_rows(db_path)) == list(read_csv_rows(path)) == rows
+    assert list(read_column(db_path, 'Image')) == [row['Image'] for row in rows]
+    with ManifestReader(db_path) as reader:
+        assert len(reader) == len(rows)
+        assert 'Root' in reader.dict_columns
+        assert 'Image' not in reader.dict_columns
+        assert list(reader.lookup('Root', 'root/plate1')) == [row for row in rows if row['Root'] == 'root/plate1']
+        assert list(reader.lookup('Image', rows[5]['Image'])) == [rows[5]]
+        assert list(reader.lookup('Root', 'missing')) == []
+
+def test_round_trip_empty(tmp_path):
+    path = str(tmp_path / 'empty.csv')
+    write_csv(path, ['Root', 'Image'], [])
+    db_path = str(tmp_path / 'empty.sqlite')
+    assert build_manifest(path, db_path) == 0
+    assert list(read_rows(db_path)) == []
+    with ManifestReader(db_path) as reader:
+        assert reader.fieldnames == ['Root', 'Image']
+
+def test_special_characters_in_path(filelist, tmp_path, monkeypatch):
+    path, rows = filelist
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('run#1 ?%20')
+    db_path = os.path.join('run#1 ?%20', 'f.sqlite')
+    build_manifest(path, db_path)
+    assert list(read_rows(db_path)) == rows
+    assert sorted(os.listdir(tmp_path)) == ['FileList.csv', 'run#1 ?%20']
+
+def test_verify_detects_difference(filelist, tmp_path):
+    path, rows = filelist
+    db_path = str(tmp_path / 'FileList.sqlite')
+    build_manifest(path, db_path)
+    assert verify_manifest(path, db_path) == len(rows)
+    rows[10]['Image'] = 'changed.tif'
+    write_csv(path, ['Root', 'Image', 'Note'], rows)
+    with pytest.raises(ValueError):
+        verify_manifest(path, db_path)
+
+def test_cli_build_and_verify(filelist, tmp_path):
+    path, rows = filelist
+    db_path = str(tmp_path / 'FileList.sqlite')
+    script = os.path.join(BINPATH, 'manifest_db.py')
+    proc = subprocess.run([sys.executable, script, 'build', path, db_path, '--index_columns', 'Image', '--verify'],
+                          capture_output = True, text = True, check = True)
+    assert '%s rows verified' % len(rows) in proc.stdout
+    proc = subprocess.run([sys.executable, script, 'verify', path, db_path], capture_output = True, text = True, check = True)
+    assert '%s rows verified' % len(rows) in proc.stdout
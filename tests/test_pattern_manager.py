@@ -0,0 +1,47 @@
+import contextlib, io
+
+import pytest
+
+from conftest import BINPATH
+import pattern_manager
+from pattern_manager import FilelistGrouper, grouping_fingerprint, sort_filenames
+
+def find_patterns(rootDir, names, **kwargs):
+    for name in names:
+        (rootDir / name).touch()
+    with contextlib.redirect_stdout(io.StringIO()):
+        grouper = FilelistGrouper(str(rootDir), **kwargs)
+        grouper.group_files()
+        grouper.find_patterns()
+    return grouper.regexes
+
+@pytest.mark.parametrize('buffer_size', [1, 2, 3, 100])
+def test_sort_filenames(buffer_size):
+    names = ['img_%s.tif' % i for i in (5, 3, 9, 1, 7, 2)]
+    assert list(sort_filenames(names, buffer_size)) == sorted(names)
+
+@pytest.mark.parametrize('buffer_size', [0, -1])
+def test_sort_buffer_must_be_positive(buffer_size):
+    with pytest.raises(ValueError):
+        sort_filenames(['b', 'a'], buffer_size)
+
+TIMEPOINTS = ('01', '02', '04', '05', '07')
+
+def test_irregular_field_is_enumerated(tmp_path):
+    names = ['img_c%s_t%s.tif' % (c, t) for c in (1, 2) for t in TIMEPOINTS]
+    assert find_patterns(tmp_path, names, fragmentation_threshold = 3) == ['img_c<1-2:1>_t<01,02,04,05,07>.tif']
+
+def test_irregular_field_is_split_without_threshold(tmp_path):
+    names = ['img_c%s_t%s.tif' % (c, t) for c in (1, 2) for t in TIMEPOINTS]
+    assert len(find_patterns(tmp_path, names)) > 1
+
+def test_grid_with_missing_combination_is_split(tmp_path):
+    names = ['img_c%s_t%s.tif' % (c, t) for c in (1, 2) for t in TIMEPOINTS if (c, t) != (2, '04')]
+    assert sorted(find_patterns(tmp_path, names, fragmentation_threshold = 3)) == ['img_c<1>_t<01,02,04,05,07>.tif', 'img_c<2>_t<01,02,05,07>.tif']
+
+def test_fingerprint_follows_the_grouping_version(tmp_path, monkeypatch):
+    (tmp_path / 'img_t01.tif').touch()
+    fingerprint = grouping_fingerprint(str(tmp_path), 'auto')
+    assert grouping_fingerprint(str(tmp_path), 'auto') == fingerprint
+    monkeypatch.setattr(pattern_manager, 'GROUPING_VERSION', pattern_manager.GROUPING_VERSION + 1)
+    assert grouping_fingerprint(str(tmp_path), 'auto') != fingerprint
@@ -0,0 +1,78 @@
+import os, sys, time
+import subprocess
+
+import pytest
+
+moto = pytest.importorskip('moto')
+boto3 = pytest.importorskip('boto3')
+
+from conftest import BINPATH
+from s3_uploader import StreamingUploader, is_metadata
+
+### Writes three chunks a second apart, then the metadata, as a converter does.
+WRITER = '''
+import os, sys, time
+root = sys.argv[1]
+os.makedirs(os.path.join(root, '0', '0'))
+for i in range(3):
+    with open(os.path.join(root, '0', '0', '%s.0' % i), 'wb') as writer:
+        writer.write(b'chunk %d' % i)
+    time.sleep(1)
+for name in ('0/0/.zarray', '0/.zattrs', '.zattrs', '.zgroup'):
+    with open(os.path.join(root, name), 'w') as writer:
+        writer.write('{}')
+time.sleep(float(sys.argv[2]) if len(sys.argv) > 2 else 0)
+'''
+
+class RecordingClient:
+    """ An S3 client, which records each uploaded key and whether the command was still running at the time. """
+    def __init__(self, client, fail = None):
+        self.client = client
+        self.fail = fail
+        self.proc = None
+        self.uploads = []
+    def upload_file(self, path, bucket, key):
+        if self.fail is not None and self.fail(key):
+            raise OSError("upload of %s failed" % key)
+        self.client.upload_file(path, bucket, key)
+        self.uploads.append((key, self.proc.poll() is None))
+
+@pytest.fixture
+def s3(monkeypatch):
+    for name in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY'):
+        monkeypatch.setenv(name, 'testing')
+    with moto.mock_aws():
+        client = boto3.client('s3', region_name = 'us-east-1')
+        client.create_bucket(Bucket = 'bucket')
+        yield client
+
+def start(client, root, *args):
+    proc = subprocess.Popen([sys.executable, '-c', WRITER, root] + list(args))
+    client.proc = proc
+    return proc
+
+def test_chunks_are_uploaded_while_the_command_runs(s3, tmp_path):
+    root = str(tmp_path / 'x.ome.zarr')
+    client = RecordingClient(s3)
+    uploader = StreamingUploader(client, 'bucket', 'out', root, workers = 2, settle = 0.2)
+    assert uploader.watch(start(client, root), interval = 0.1) == 0
+    keys = [key for key, running in client.uploads]
+    chunks = [key for key in keys if not is_metadata(key)]
+    assert sorted(chunks) == ['out/x.ome.zarr/0/0/%s.0' % i for i in range(3)]
+    assert any(running for key, running in client.uploads if not is_metadata(key))
+    ### The metadata arrives after all chunks, deepest first.
+    assert keys[len(chunks):] == ['out/x.ome.zarr/0/0/.zarray', 'out/x.ome.zarr/0/.zattrs', 'out/x.ome.zarr/.zattrs', 'out/x.ome.zarr/.zgroup']
+    listed = s3.list_objects_v2(Bucket = 'bucket')['Contents']
+    assert sorted(item['Key'] for item in listed) == sorted(keys)
+    assert s3.get_object(Bucket = 'bucket', Key = 'out/x.ome.zarr/0/0/1.0')['Body'].read() == b'chunk 1'
+
+def test_failing_upload_terminates_the_command(s3, tmp_path):
+    root = str(tmp_path / 'x.ome.zarr')
+    client = RecordingClient(s3, fail = lambda key: key.endswith('/0.0'))
+    uploader = StreamingUploader(client, 'bucket', '', root, workers = 2, settle = 0.2)
+    proc = start(client, root, '60')
+    t0 = time.perf_counter()
+    with pytest.raises(OSError):
+        uploader.watch(proc, interval = 0.1)
+    assert proc.poll() is not None and proc.returncode != 0
+    assert time.perf_counter() - t0 < 30
@@ -0,0 +1,83 @@
+import os, sys
+
+import pytest
+
+from conftest import BINPATH
+from scratch_stage import Stager, stage_input
+
+SHOWINF = '''#!%s
+import os, sys
+if os.environ.get('FAKE_SHOWINF_FAIL'):
+    sys.exit(1)
+print("Reading core metadata")
+used = [path for path in os.environ.get('FAKE_USED_FILES', '').split(os.pathsep) if path != '']
+if len(used) > 1:
+    print("Used files:")
+    for path in used:
+        print("\\t%%s" %% path)
+print("Series count = 1")
+'''
+
+@pytest.fixture
+def showinf(tmp_path, monkeypatch):
+    """ A fake showinf, which lists the files in FAKE_USED_FILES as the used files of its input. """
+    bindir = tmp_path / 'bin'
+    bindir.mkdir()
+    path = bindir / 'showinf'
+    path.write_text(SHOWINF % sys.executable)
+    path.chmod(0o755)
+    monkeypatch.setenv('PATH', str(bindir) + os.pathsep + os.environ['PATH'])
+    return monkeypatch
+
+def write_file(path, content = b'data'):
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    with open(path, 'wb') as writer:
+        writer.write(content)
+    return path
+
+def test_used_files_are_staged(tmp_path, showinf):
+    inps = write_file(str(tmp_path / 'in' / 'slide.vsi'), b'vsi')
+    ets = write_file(str(tmp_path / 'in' / '_slide_' / 'stack1' / 'frame_t.ets'), b'pixels')
+    showinf.setenv('FAKE_USED_FILES', os.pathsep.join([inps, ets]))
+    stagedir = tmp_path / 'stage'
+    stagedir.mkdir()
+    path, size = stage_input(inps, str(stagedir))
+    assert path == str(stagedir / 'slide.vsi')
+    assert (stagedir / '_slide_' / 'stack1' / 'frame_t.ets').read_bytes() == b'pixels'
+    assert size == len(b'vsi') + len(b'pixels')
+
+def test_single_file_is_staged(tmp_path, showinf):
+    inps = write_file(str(tmp_path / 'in' / 'image.czi'))
+    stagedir = tmp_path / 'stage'
+    stagedir.mkdir()
+    assert stage_input(inps, str(stagedir)) == (str(stagedir / 'image.czi'), 4)
+    assert os.listdir(stagedir) == ['image.czi']
+
+def test_used_files_outside_the_input_directory_are_not_staged(tmp_path, showinf):
+    inps = write_file(str(tmp_path / 'in' / 'image.ome.tiff'))
+    companion = write_file(str(tmp_path / 'other' / 'image.companion.ome'))
+    showinf.setenv('FAKE_USED_FILES', os.pathsep.join([inps, companion]))
+    stagedir = tmp_path / 'stage'
+    stagedir.mkdir()
+    assert stage_input(inps, str(stagedir)) == (inps, 0)
+    assert os.listdir(stagedir) == []
+
+def test_input_is_not_staged_if_showinf_fails(tmp_path, showinf):
+    inps = write_file(str(tmp_path / 'in' / 'image.mrxs'))
+    showinf.setenv('FAKE_SHOWINF_FAIL', '1')
+    stager = Stager(str(tmp_path / 'stage'), [inps], lookahead = 0)
+    try:
+        assert stager.acquire(0) == inps
+    finally:
+        stager.close()
+    assert os.listdir(tmp_path / 'stage') == []
+
+def test_pattern_files_are_staged(tmp_path):
+    for name in ('img_t0.tif', 'img_t1.tif', 'img_t2.tif'):
+        write_file(str(tmp_path / 'in' / name))
+    inps = write_file(str(tmp_path / 'in' / 'img_t_range.pattern'), b'img_t<0-2>.tif')
+    stagedir = tmp_path / 'stage'
+    stagedir.mkdir()
+    path, size = stage_input(inps, str(stagedir))
+    assert path == str(stagedir / 'img_t_range.pattern')
+    assert sorted(os.listdir(stagedir)) == ['img_t0.tif', 'img_t1.tif', 'img_t2.tif', 'img_t_range.pattern']
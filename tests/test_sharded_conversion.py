@@ -0,0 +1,114 @@
+import argparse, json, os, shutil, sys
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from conftest import BINPATH
+from run_conversion import TelemetryLog, assemble_shards, convert, convert_sharded, get_shard_path, split_series
+
+OME_NS = 'http://www.openmicroscopy.org/Schemas/OME/2016-06'
+
+def write_json(path, obj):
+    with open(path, 'w') as writer:
+        json.dump(obj, writer)
+
+def write_zarr(path, series, renumber = False, all_images = None):
+    """
+    Writes a minimal bioformats2raw layout with the given series of an input. With renumber, the series groups and
+    images are numbered from 0, as bioformats2raw --series may do. all_images is the number of images the OME-XML
+    describes, if it describes all series of the input rather than the selected ones.
+    """
+    os.makedirs(os.path.join(path, 'OME'))
+    write_json(os.path.join(path, '.zattrs'), {'bioformats2raw.layout': 3})
+    write_json(os.path.join(path, '.zgroup'), {'zarr_format': 2})
+    groups = list(range(len(series))) if renumber else series
+    for group, item in zip(groups, series):
+        os.makedirs(os.path.join(path, '%s' % group, '0'))
+        write_json(os.path.join(path, '%s' % group, '.zattrs'), {'multiscales': [{'name': 'image %s' % item}]})
+        with open(os.path.join(path, '%s' % group, '0', '0.0'), 'wb') as writer:
+            writer.write(b'series %d' % item)
+    write_json(os.path.join(path, 'OME', '.zattrs'), {'series': ['%s' % group for group in groups]})
+    images = list(zip(groups, series)) if all_images is None else [(item, item) for item in range(all_images)]
+    xml = ''.join('<Image ID="Image:%s" Name="image %s"><Pixels ID="Pixels:%s"><Channel ID="Channel:%s:0"/></Pixels></Image>'
+                  % (index, item, index, index) for index, item in images)
+    with open(os.path.join(path, 'OME', 'METADATA.ome.xml'), 'w') as writer:
+        writer.write('<?xml version="1.0" encoding="UTF-8"?><OME xmlns="%s"><Instrument ID="Instrument:0"/>%s'
+                     '<StructuredAnnotations/></OME>' % (OME_NS, xml))
+
+def read_tree(path):
+    """ The files of an OME-Zarr: json files parsed, the OME-XML canonicalized and the chunks as bytes. """
+    tree = {}
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in filenames:
+            fpath = os.path.join(dirpath, name)
+            relpath = os.path.relpath(fpath, path)
+            if name in ('.zattrs', '.zgroup', '.zarray'):
+                with open(fpath, 'r') as reader:
+                    tree[relpath] = json.load(reader)
+            elif name.endswith('.xml'):
+                root = ET.parse(fpath).getroot()
+                tree[relpath] = [ET.canonicalize(ET.tostring(child), strip_text = True) for child in root]
+            else:
+                with open(fpath, 'rb') as reader:
+                    tree[relpath] = reader.read()
+    return tree
+
+@pytest.mark.parametrize('renumber, all_images', [(True, None), (False, None), (False, 5)])
+def test_assembled_tree_matches_single_conversion(tmp_path, renumber, all_images):
+    outs = str(tmp_path / 'x.ome.zarr')
+    single = str(tmp_path / 'single.ome.zarr')
+    write_zarr(single, list(range(5)))
+    shards = split_series(5, 2)
+    for index, series in enumerate(shards):
+        write_zarr(get_shard_path(outs, index), series, renumber, all_images)
+    assemble_shards(argparse.Namespace(output_type = 'omezarr'), outs, shards)
+    assert read_tree(outs) == read_tree(single)
+    assert not os.path.exists(get_shard_path(outs, 0))
+
+def test_plate_shards_are_rejected(tmp_path):
+    outs = str(tmp_path / 'plate.ome.zarr')
+    shards = split_series(4, 2)
+    for index, series in enumerate(shards):
+        path = get_shard_path(outs, index)
+        write_zarr(path, series)
+        write_json(os.path.join(path, '.zattrs'), {'bioformats2raw.layout': 3, 'plate': {'rows': [{'name': 'A'}]}})
+    with pytest.raises(ValueError, match = 'Plate'):
+        assemble_shards(argparse.Namespace(output_type = 'omezarr'), outs, shards)
+    assert not os.path.exists(outs)
+
+BIOFORMATS2RAW = '''#!%s
+import sys
+sys.path.insert(0, %r)
+from test_sharded_conversion import write_zarr
+args = sys.argv[1:]
+series = [int(item) for item in args[args.index('--series') + 1].split(',')]
+write_zarr(args[-1], series, renumber = True)
+'''
+
+def test_sharded_conversion_writes_telemetry(tmp_path, monkeypatch):
+    bindir = tmp_path / 'bin'
+    bindir.mkdir()
+    (bindir / 'bioformats2raw').write_text(BIOFORMATS2RAW % (sys.executable, os.path.dirname(os.path.abspath(__file__))))
+    (bindir / 'bioformats2raw').chmod(0o755)
+    monkeypatch.setenv('PATH', str(bindir) + os.pathsep + os.environ['PATH'])
+    inps = tmp_path / 'x.czi'
+    inps.write_bytes(b'data')
+    outs = str(tmp_path / 'x.ome.zarr')
+    log = str(tmp_path / 'telemetry.jsonl')
+    assert convert_sharded(argparse.Namespace(output_type = 'omezarr'), str(inps), outs, 3, series_count = 5, telemetry = TelemetryLog(log)) == 0
+    with open(log, 'r') as reader:
+        records = sorted([json.loads(line) for line in reader], key = lambda record: record['shard'])
+    assert [(record['shard'], record['series'], record['returncode']) for record in records] == [(0, [0, 1], 0), (1, [2, 3], 0), (2, [4, 4], 0)]
+    assert all(record['input_bytes'] == 4 and record['output_bytes'] > 0 for record in records)
+    assert sorted(name for name in os.listdir(outs) if name.isdigit()) == ['0', '1', '2', '3', '4']
+
+@pytest.mark.skipif(shutil.which('bioformats2raw') is None, reason = 'bioformats2raw is not installed.')
+def test_sharded_fake_input_matches_single_conversion(tmp_path):
+    inps = str(tmp_path / 'multi&series=5&sizeX=64&sizeY=64&sizeC=2.fake')
+    open(inps, 'w').close()
+    args = argparse.Namespace(output_type = 'omezarr')
+    single = str(tmp_path / 'single.ome.zarr')
+    sharded = str(tmp_path / 'sharded.ome.zarr')
+    assert convert(args, inps, single, capture = True)[0] == 0
+    assert convert_sharded(args, inps, sharded, 3, series_count = 5) == 0
+    assert read_tree(sharded) == read_tree(single)